@@ -1,12 +1,22 @@
-import asyncio
 import logging
 import os
 from pathlib import Path
-from typing import Type
+from typing import (
+    AsyncIterable,
+    Iterable,
+    Type,
+    Union,
+)
 
-import pydash
 import pyrogram
 
+from app.bot.utils.broadcast import (
+    Broadcaster,
+    BroadcastStats,
+    ProgressCallback,
+    ResultCallback,
+    copy_message_sender,
+)
 from app.bot.utils.chat_commands import (
     BaseCommandsSet,
     PrivateCommands,
@@ -59,9 +69,21 @@ class Bot(pyrogram.Client):
                 )
             )
 
-    async def broadcast_message(self, message: pyrogram.types.Message, *, chats: list[int] = None):
-        tasks = pydash.chunk([message.copy(chat_id) for chat_id in chats], 30)
-
-        for chunk in tasks:
-            await asyncio.gather(*chunk, return_exceptions=True)
-            await asyncio.sleep(1)
+    async def broadcast_message(
+            self,
+            message: pyrogram.types.Message,
+            *,
+            chats: Union[Iterable[int], AsyncIterable[int]],
+            total: int = None,
+            on_result: ResultCallback = None,
+            on_progress: ProgressCallback = None,
+    ) -> BroadcastStats:
+        broadcaster = Broadcaster(
+            copy_message_sender(message),
+            rate=settings.BROADCAST_RATE,
+            workers=settings.BROADCAST_WORKERS,
+            progress_interval=settings.BROADCAST_PROGRESS_INTERVAL,
+            on_result=on_result,
+            on_progress=on_progress,
+        )
+        return await broadcaster.run(chats, total=total)
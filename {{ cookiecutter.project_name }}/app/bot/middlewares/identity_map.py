@@ -0,0 +1,14 @@
+from pyrogram.middleware import CallNextMiddlewareCallable
+from pyrogram.types import Update
+
+from app.database.crud.batch_loader import identity_map
+
+
+async def identity_map_middleware(_, update: Update, call_next: CallNextMiddlewareCallable):
+    # Rows loaded by primary key are shared by everything handling this update
+    token = identity_map.set({})
+
+    try:
+        return await call_next(_, update)
+    finally:
+        identity_map.reset(token)
@@ -1,55 +1,118 @@
 import logging
-from typing import Union
+from typing import (
+    Optional,
+    Union,
+)
 
-import aioredis
-import pydantic
 from pyrogram.middleware import CallNextMiddlewareCallable
 from pyrogram.types import (
     CallbackQuery,
     Message,
 )
 
+from app.bot.utils.state_storage import create_state_storage
 from app.settings import settings
-from app.utils import json
+from app.utils import codecs
 
 logger = logging.getLogger('user_state_middleware')
-redis = aioredis.from_url(f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.BOT_ID}_user_states")
+storage = create_state_storage(
+    settings.USER_STATE_STORAGE,
+    redis_url=f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.BOT_ID}_user_states",
+    memory_size=settings.USER_STATE_MEMORY_SIZE,
+    l1_ttl=settings.USER_STATE_L1_TTL,
+    channel=f"{settings.BOT_ID}_user_states:invalidations",
+)
+state_codec = codecs.get_codec(settings.USER_STATE_CODEC)
+
+
+class UserState:
+    __slots__ = ('chat_id', 'user_id', 'name', 'data')
+
+    def __init__(self, chat_id: int, user_id: int, name: str = None, data: dict = None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.name = name
+        self.data = data
+
+    def __repr__(self) -> str:
+        return f"UserState(chat_id={self.chat_id}, user_id={self.user_id}, name={self.name!r}, data={self.data!r})"
 
+    @property
+    def key(self) -> str:
+        return f"{self.chat_id}_{self.user_id}"
 
-class UserState(pydantic.BaseModel):
-    chat_id: int
-    user_id: int
-    name: str = None
-    data: dict = None
+    @property
+    def fields_key(self) -> str:
+        return f"{self.key}:fields"
 
     async def clear(self) -> 'UserState':
-        return await self.set(name=None, data=None)
+        self.name = None
+        self.data = None
+        await storage.delete(self.key, self.fields_key)
+        return self
 
-    async def set(self, name: str = None, data: dict = None) -> 'UserState':
+    async def set(self, name: str = None, data: dict = None, *, ttl: int = None) -> 'UserState':
+        # ttl=None falls back to USER_STATE_TTL, ttl=0 stores state without expiration
+        ttl = settings.USER_STATE_TTL if ttl is None else ttl
         self.name = name
         self.data = data
-        await redis.set(f"{self.chat_id}_{self.user_id}", self.json())
+        # chat_id and user_id are already in the key, so only name and data are stored
+        await storage.set(self.key, state_codec.encode({'name': self.name, 'data': self.data}), ttl=ttl)
         return self
 
-    class Config:
-        json_dumps = json.dumps
-        json_loads = json.loads
-        use_enum_values = True
-        validate_assignment = True
+    async def set_fields(self, fields: dict, *, ttl: int = None):
+        # Separate key with independently updated fields, e.g. dialog answers. Removed by clear()
+        ttl = settings.USER_STATE_TTL if ttl is None else ttl
+        # Values are wrapped into list, so their format is recognizable by codecs.decode
+        encoded = {k: state_codec.encode([v]) for k, v in fields.items()}
+        await storage.set_fields(self.fields_key, encoded, ttl=ttl)
+
+    async def get_fields(self) -> dict:
+        fields = await storage.get_fields(self.fields_key)
+        return {k: codecs.decode(v)[0] for k, v in fields.items()}
+
+
+class LazyUserState:
+    def __init__(self, chat_id: int, user_id: int):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self._state: Optional[UserState] = None
+
+    def __await__(self):
+        return self.get().__await__()
+
+    async def get(self) -> UserState:
+        if self._state is None:
+            user_state_data = await storage.get(f"{self.chat_id}_{self.user_id}")
+            user_state_data = codecs.decode(user_state_data) if bool(user_state_data) else {}
+
+            self._state = UserState(
+                chat_id=self.chat_id,
+                user_id=self.user_id,
+                name=user_state_data.get('name'),
+                data=user_state_data.get('data'),
+            )
+
+        return self._state
+
+    async def clear(self) -> UserState:
+        if self._state is None:
+            self._state = UserState(chat_id=self.chat_id, user_id=self.user_id)
+
+        return await self._state.clear()
+
+    async def set(self, name: str = None, data: dict = None, *, ttl: int = None) -> UserState:
+        # Writing doesn't depend on the stored value, so there is no need to load it first
+        if self._state is None:
+            self._state = UserState(chat_id=self.chat_id, user_id=self.user_id)
+
+        return await self._state.set(name=name, data=data, ttl=ttl)
 
 
 async def user_state_middleware(_, update: Union[Message, CallbackQuery], call_next: CallNextMiddlewareCallable):
     if isinstance(update, (Message, CallbackQuery)):
         message = update if isinstance(update, Message) else update.message
-        user_state_data = await redis.get(f"{message.chat.id}_{update.from_user.id}")
-        user_state_data = json.loads(user_state_data.decode('utf-8')) if bool(user_state_data) else {}
-
-        user_state = UserState(
-            chat_id=message.chat.id,
-            user_id=update.from_user.id,
-            name=user_state_data.get('name'),
-            data=user_state_data.get('data'),
-        )
+        user_state = LazyUserState(chat_id=message.chat.id, user_id=update.from_user.id)
         update.bucket.state = user_state
 
         if isinstance(update, CallbackQuery):
@@ -1,23 +1,97 @@
+from typing import Optional
+
+import pydantic
 import pyrogram.filters
 
 from app.bot.bot import Bot
+from app.bot.utils.broadcast_jobs import broadcast_jobs
 from app.bot.utils.chat_commands import (
     CommandArgs,
     PrivateCommands,
 )
 from app.database import crud
+from app.database.model.broadcast_job import (
+    BroadcastJob,
+    BroadcastJobStatus,
+)
 
 
 class AnnounceArgs(CommandArgs):
     users: list[int] = []
 
 
+class BroadcastJobArgs(CommandArgs):
+    job_id: Optional[int] = pydantic.Field(None, description='Broadcast job id, the last job by default')
+
+
+def format_job(job: BroadcastJob) -> str:
+    total = job.total if job.total is not None else '?'
+    processed = job.sent + job.blocked + job.failed
+    running = " (in progress)" if broadcast_jobs.is_running(job.id) else ""
+
+    return (
+        f"<b>Broadcast #{job.id}</b>\n"
+        f"Status: {job.status}{running}\n"
+        f"Processed: {processed}/{total}\n"
+        f"Sent: {job.sent}, blocked: {job.blocked}, failed: {job.failed}\n"
+        f"Last user: {job.last_user_id}"
+    )
+
+
+async def get_job(message: pyrogram.types.Message) -> Optional[BroadcastJob]:
+    job_id = message.bucket.args.job_id
+    job = await crud.broadcast_job.get(job_id) if job_id is not None else await crud.broadcast_job.get_last()
+
+    if job is None:
+        await message.reply("Broadcast job is not found", quote=True)
+
+    return job
+
+
 @PrivateCommands.ANNOUNCE(reply=True, args_model=AnnounceArgs)
 async def announce(bot: Bot, message: pyrogram.types.Message):
-    users = message.bucket.args.users
+    job = await broadcast_jobs.create(bot, message.reply_to_message, message.bucket.args.users)
+    await message.reply(f"Broadcast #{job.id} is started", quote=True)
+    message.stop_propagation()
+
+
+@PrivateCommands.BROADCAST_STATUS(args_model=BroadcastJobArgs)
+async def broadcast_status(bot: Bot, message: pyrogram.types.Message):
+    job = await get_job(message)
+
+    if job is not None:
+        await message.reply(format_job(job), quote=True)
+
+    message.stop_propagation()
+
+
+@PrivateCommands.BROADCAST_PAUSE(args_model=BroadcastJobArgs)
+async def broadcast_pause(bot: Bot, message: pyrogram.types.Message):
+    job = await get_job(message)
+
+    if job is None:
+        return message.stop_propagation()
+
+    if job.status != BroadcastJobStatus.RUNNING:
+        await message.reply(f"Broadcast #{job.id} is {job.status}", quote=True)
+        return message.stop_propagation()
+
+    job = await broadcast_jobs.pause(job)
+    await message.reply(format_job(job), quote=True)
+    message.stop_propagation()
+
+
+@PrivateCommands.BROADCAST_RESUME(args_model=BroadcastJobArgs)
+async def broadcast_resume(bot: Bot, message: pyrogram.types.Message):
+    job = await get_job(message)
+
+    if job is None:
+        return message.stop_propagation()
 
-    if len(users) == 0:
-        users = [u.id for u in (await crud.user.get_multi())]
+    if job.status != BroadcastJobStatus.PAUSED:
+        await message.reply(f"Broadcast #{job.id} is {job.status}", quote=True)
+        return message.stop_propagation()
 
-    await bot.broadcast_message(message.reply_to_message, chats=users)
+    job = await broadcast_jobs.resume(bot, job)
+    await message.reply(format_job(job), quote=True)
     message.stop_propagation()
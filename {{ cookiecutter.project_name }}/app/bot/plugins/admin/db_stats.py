@@ -0,0 +1,32 @@
+import html
+
+import pyrogram.filters
+
+from app.bot.bot import Bot
+from app.bot.utils.chat_commands import PrivateCommands
+from app.database.crud.model_cache import collect_model_cache_stats
+from app.database.database import objects
+
+
+def format_db_stats(limit: int = 10) -> str:
+    lines = [f"{key}: {value}" for key, value in objects.pool_stats().items()]
+    lines.append("")
+    lines.append("Top queries by total time (count, total ms, max ms):")
+
+    for fingerprint, stats in objects.metrics.top_queries(limit):
+        lines.append(
+            f"{stats.count:>8} {stats.total_time * 1000:>10.1f} {stats.max_time * 1000:>8.1f}  {fingerprint[:200]}"
+        )
+
+    for cache_stats in collect_model_cache_stats():
+        lines.append("")
+        lines.append(f"{cache_stats.pop('model')} cache:")
+        lines.extend(f"{key}: {value}" for key, value in cache_stats.items())
+
+    return "\n".join(lines)
+
+
+@PrivateCommands.DB_STATS()
+async def db_stats(bot: Bot, message: pyrogram.types.Message):
+    await message.reply(f"<pre>{html.escape(format_db_stats())}</pre>", quote=True)
+    message.stop_propagation()
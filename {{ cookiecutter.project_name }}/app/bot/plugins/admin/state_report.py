@@ -0,0 +1,17 @@
+import html
+
+import pyrogram.filters
+
+from app.bot.bot import Bot
+from app.bot.utils.chat_commands import PrivateCommands
+from app.bot.utils.state_report import (
+    collect_states_report,
+    format_states_report,
+)
+
+
+@PrivateCommands.STATE_REPORT()
+async def state_report(bot: Bot, message: pyrogram.types.Message):
+    report = await collect_states_report()
+    await message.reply(f"<pre>{html.escape(format_states_report(report, limit=30))}</pre>", quote=True)
+    message.stop_propagation()
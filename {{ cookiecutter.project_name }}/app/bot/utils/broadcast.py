@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from typing import (
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Iterable,
+    Optional,
+    Union,
+)
+
+import pyrogram
+from pyrogram.errors import (
+    ChannelPrivate,
+    ChatWriteForbidden,
+    FloodWait,
+    InputUserDeactivated,
+    PeerIdInvalid,
+    UserDeactivated,
+    UserDeactivatedBan,
+    UserIsBlocked,
+    UserIsBot,
+)
+
+logger = logging.getLogger('Broadcast')
+
+# Message will never be delivered to such chats, there is no sense to retry
+PERMANENT_ERRORS = (
+    ChannelPrivate,
+    ChatWriteForbidden,
+    InputUserDeactivated,
+    PeerIdInvalid,
+    UserDeactivated,
+    UserDeactivatedBan,
+    UserIsBlocked,
+    UserIsBot,
+)
+
+SendFunction = Callable[[int], Awaitable]
+ResultCallback = Callable[[int, Optional[Exception]], Awaitable]
+ProgressCallback = Callable[['BroadcastStats'], Awaitable]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None, *, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # Lock keeps waiters in FIFO order, so nobody starves
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                if self.paused_until > now:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    @property
+    def is_paused(self) -> bool:
+        return self.paused_until > time.monotonic()
+
+    def pause(self, seconds: float):
+        # Global pause for every sender, nothing is sent until it ends
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self._updated_at = max(self._updated_at, self.paused_until)
+
+    def decrease(self, factor: float = 0.5):
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def increase(self, step: float = 1.0):
+        self.rate = min(self.max_rate, self.rate + step)
+
+
+class BroadcastStats:
+    def __init__(self, total: int = None):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.flood_waits = 0
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def remaining(self) -> Optional[int]:
+        return max(self.total - self.processed, 0) if self.total is not None else None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'blocked': self.blocked,
+            'remaining': self.remaining,
+            'flood_waits': self.flood_waits,
+            'elapsed': round(self.elapsed, 2),
+            'throughput': round(self.throughput, 2),
+        }
+
+    def __str__(self) -> str:
+        remaining = self.remaining if self.remaining is not None else '?'
+
+        return (
+            f"Sent: {self.sent}, failed: {self.failed}, blocked: {self.blocked}, remaining: {remaining}, "
+            f"{self.throughput:.1f} msg/s"
+        )
+
+
+async def _iterate_chats(chats: Union[Iterable[int], AsyncIterable[int]]) -> AsyncIterable[int]:
+    if hasattr(chats, '__aiter__'):
+        async for chat_id in chats:
+            yield chat_id
+    else:
+        for chat_id in chats:
+            yield chat_id
+
+
+# Sends to chat ids from a stream with a bounded number of in-flight messages.
+# Sending rate is decreased on FloodWait and slowly restored while there are no FloodWait errors
+class Broadcaster:
+    def __init__(
+            self,
+            send: SendFunction,
+            *,
+            rate: float = 25,
+            min_rate: float = 1,
+            workers: int = 30,
+            max_retries: int = 3,
+            progress_interval: float = 10,
+            on_result: ResultCallback = None,
+            on_progress: ProgressCallback = None,
+    ):
+        self.send = send
+        # Small bursts only, messages are spread evenly over a second
+        self.bucket = TokenBucket(rate, max(rate / 10, 1), min_rate=min_rate)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.on_result = on_result
+        self.on_progress = on_progress
+        self.stats = BroadcastStats()
+
+    async def run(self, chats: Union[Iterable[int], AsyncIterable[int]], *, total: int = None) -> BroadcastStats:
+        self.stats = BroadcastStats(total)
+        queue: asyncio.Queue[Optional[int]] = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report_progress())
+
+        try:
+            async for chat_id in _iterate_chats(chats):
+                await queue.put(chat_id)
+
+            for _ in workers:
+                await queue.put(None)
+
+            await asyncio.gather(*workers)
+        finally:
+            for task in [*workers, reporter]:
+                task.cancel()
+
+            self.stats.finished_at = time.monotonic()
+
+        await self._progress()
+        return self.stats
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            chat_id = await queue.get()
+
+            if chat_id is None:
+                return
+
+            error = await self._send(chat_id)
+
+            if self.on_result is None:
+                continue
+
+            try:
+                await self.on_result(chat_id, error)
+            except Exception as e:
+                logger.warning(f"Result callback failed for {chat_id}. {e.__class__.__qualname__}. {e}")
+
+    async def _send(self, chat_id: int) -> Optional[Exception]:
+        error = None
+
+        for _ in range(self.max_retries + 1):
+            await self.bucket.acquire()
+
+            try:
+                await self.send(chat_id)
+                self.stats.sent += 1
+                self.bucket.increase(0.1)
+                return None
+            except FloodWait as e:
+                error = e
+                self.stats.flood_waits += 1
+                # In-flight messages get FloodWait together, rate is decreased once per wait
+                if not self.bucket.is_paused:
+                    self.bucket.decrease()
+
+                self.bucket.pause(e.x)
+                logger.info(f"FloodWait for {e.x} seconds, rate is decreased to {self.bucket.rate:.1f} msg/s")
+            except PERMANENT_ERRORS as e:
+                self.stats.blocked += 1
+                return e
+            except Exception as e:
+                logger.warning(f"Unable to send broadcast message to {chat_id}. {e.__class__.__qualname__}. {e}")
+                self.stats.failed += 1
+                return e
+
+        self.stats.failed += 1
+        return error
+
+    async def _progress(self):
+        logger.info(str(self.stats))
+
+        if self.on_progress is not None:
+            try:
+                await self.on_progress(self.stats)
+            except Exception as e:
+                logger.warning(f"Progress callback failed. {e.__class__.__qualname__}. {e}")
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._progress()
+
+
+def copy_message_sender(message: pyrogram.types.Message) -> SendFunction:
+    async def send(chat_id: int):
+        await message.copy(chat_id)
+
+    return send
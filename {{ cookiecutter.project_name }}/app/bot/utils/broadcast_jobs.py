@@ -0,0 +1,207 @@
+import asyncio
+import collections
+import logging
+from typing import (
+    AsyncIterator,
+    Optional,
+)
+
+import pyrogram
+
+from app.bot.bot import Bot
+from app.bot.utils.broadcast import (
+    PERMANENT_ERRORS,
+    BroadcastStats,
+)
+from app.database import crud
+from app.database.model.broadcast_job import (
+    BroadcastJob,
+    BroadcastJobStatus,
+)
+from app.database.model.user import User
+from app.settings import settings
+
+logger = logging.getLogger('BroadcastJobs')
+
+
+# Users are sent in ascending order of ids, but results come in any order.
+# Checkpoint moves only over users with known results, so nobody is skipped after a restart
+class BroadcastCheckpoint:
+    def __init__(self, last_user_id: int):
+        self.last_user_id = last_user_id
+        self.sent = 0
+        self.blocked = 0
+        self.failed_users: list[int] = []
+        self._issued: collections.deque[int] = collections.deque()
+        self._results: dict[int, Optional[Exception]] = {}
+
+    @property
+    def pending_results(self) -> int:
+        return self.sent + self.blocked + len(self.failed_users)
+
+    def issue(self, user_id: int):
+        self._issued.append(user_id)
+
+    def complete(self, user_id: int, error: Optional[Exception]):
+        self._results[user_id] = error
+
+        while self._issued and self._issued[0] in self._results:
+            user_id = self._issued.popleft()
+            error = self._results.pop(user_id)
+            self.last_user_id = user_id
+
+            if error is None:
+                self.sent += 1
+            elif isinstance(error, PERMANENT_ERRORS):
+                self.blocked += 1
+            else:
+                self.failed_users.append(user_id)
+
+    def pop_progress(self) -> dict:
+        progress = dict(
+            last_user_id=self.last_user_id,
+            sent=self.sent,
+            blocked=self.blocked,
+            failed_users=self.failed_users,
+        )
+        self.sent = 0
+        self.blocked = 0
+        self.failed_users = []
+        return progress
+
+    def restore_progress(self, progress: dict):
+        # Counters of a failed save are returned back and saved with the next one
+        self.sent += progress['sent']
+        self.blocked += progress['blocked']
+        self.failed_users = progress['failed_users'] + self.failed_users
+
+
+async def iterate_audience(users: Optional[list[int]], after_user_id: int) -> AsyncIterator[int]:
+    if users is not None:
+        for user_id in sorted(set(users)):
+            if user_id > after_user_id:
+                yield user_id
+
+        return
+
+    async for (user_id,) in crud.user.iterate(select=[User.id], tuples=True, offset_id=after_user_id):
+        yield user_id
+
+
+class BroadcastJobRunner:
+    def __init__(self, checkpoint_batch: int = 100):
+        self.checkpoint_batch = checkpoint_batch
+        self._tasks: dict[int, asyncio.Task] = {}
+        # Jobs which should stop taking new users, in-flight messages are still delivered
+        self._stopping: set[int] = set()
+        # Pause waits for in-flight messages, resume shouldn't see the task which is about to stop
+        self._control_lock = asyncio.Lock()
+
+    def is_running(self, job_id: int) -> bool:
+        return job_id in self._tasks
+
+    async def create(self, bot: Bot, message: pyrogram.types.Message, users: list[int] = None) -> BroadcastJob:
+        total = len(set(users)) if users else await crud.user.get_total_count()
+        job = await crud.broadcast_job.create(
+            created_by=message.from_user.id if message.from_user else message.chat.id,
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+            users=users or None,
+            total=total,
+        )
+        self.start(bot, job)
+        return job
+
+    def start(self, bot: Bot, job: BroadcastJob):
+        if self.is_running(job.id):
+            return
+
+        task = asyncio.create_task(self._run(bot, job))
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        self._tasks[job.id] = task
+
+    async def pause(self, job: BroadcastJob) -> BroadcastJob:
+        async with self._control_lock:
+            job = await crud.broadcast_job.set_status(job, BroadcastJobStatus.PAUSED)
+            await self._stop(job.id)
+            return await crud.broadcast_job.get(job.id)
+
+    async def resume(self, bot: Bot, job: BroadcastJob) -> BroadcastJob:
+        async with self._control_lock:
+            job = await crud.broadcast_job.set_status(job, BroadcastJobStatus.RUNNING)
+            self.start(bot, job)
+            return job
+
+    async def resume_interrupted(self, bot: Bot):
+        for job in await crud.broadcast_job.get_running():
+            logger.info(f"Resuming broadcast job {job.id} after user {job.last_user_id}")
+            self.start(bot, job)
+
+    async def close(self):
+        # Status of jobs is kept, so they are resumed on the next start
+        await asyncio.gather(*[self._stop(job_id) for job_id in list(self._tasks)])
+
+    async def _stop(self, job_id: int):
+        task = self._tasks.get(job_id)
+
+        if task is None:
+            return
+
+        self._stopping.add(job_id)
+
+        try:
+            await asyncio.shield(task)
+        except Exception as e:
+            logger.warning(f"Broadcast job {job_id} failed. {e.__class__.__qualname__}. {e}")
+        finally:
+            self._stopping.discard(job_id)
+
+    async def _run(self, bot: Bot, job: BroadcastJob):
+        message = await bot.get_messages(job.from_chat_id, job.message_id)
+
+        if message is None or message.empty:
+            logger.warning(f"Source message of broadcast job {job.id} is not found")
+            await crud.broadcast_job.set_status(job, BroadcastJobStatus.FINISHED)
+            return
+
+        checkpoint = BroadcastCheckpoint(job.last_user_id)
+        save_lock = asyncio.Lock()
+
+        async def save_progress():
+            async with save_lock:
+                progress = checkpoint.pop_progress()
+
+                try:
+                    await crud.broadcast_job.save_progress(job, **progress)
+                except Exception:
+                    checkpoint.restore_progress(progress)
+                    raise
+
+        async def chats() -> AsyncIterator[int]:
+            async for user_id in iterate_audience(job.users, job.last_user_id):
+                if job.id in self._stopping:
+                    return
+
+                checkpoint.issue(user_id)
+                yield user_id
+
+        async def on_result(user_id: int, error: Optional[Exception]):
+            checkpoint.complete(user_id, error)
+
+            if checkpoint.pending_results >= self.checkpoint_batch and not save_lock.locked():
+                await save_progress()
+
+        async def on_progress(stats: BroadcastStats):
+            await save_progress()
+
+        done = job.sent + job.blocked + job.failed
+        total = max(job.total - done, 0) if job.total is not None else None
+        await bot.broadcast_message(message, chats=chats(), total=total, on_result=on_result, on_progress=on_progress)
+        await save_progress()
+
+        if job.id not in self._stopping:
+            await crud.broadcast_job.set_status(job, BroadcastJobStatus.FINISHED)
+            logger.info(f"Broadcast job {job.id} is finished")
+
+
+broadcast_jobs = BroadcastJobRunner(settings.BROADCAST_CHECKPOINT_BATCH)
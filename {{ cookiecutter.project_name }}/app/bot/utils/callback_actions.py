@@ -1,16 +1,26 @@
+from functools import cached_property
+
 import pyrogram
 
-from app.bot.utils.callback_data import CallbackData
+from app.bot.utils.callback_data import (
+    CallbackData,
+    CallbackSchema,
+)
 from app.bot.utils.custom_filters import CustomFilters
+from app.bot.utils.router import (
+    combine_filters,
+    command_router,
+)
 
 
 class CallbackAction(str):
-    def __new__(cls, command: str, *, admin: bool = False):
+    def __new__(cls, command: str, *, admin: bool = False, fields: dict[str, type] = None, binary: bool = False):
         obj = super(CallbackAction, cls).__new__(cls, command)
         obj.admin = admin
+        obj.schema = CallbackSchema(command, fields, binary=binary) if fields is not None else None
         return obj
 
-    @property
+    @cached_property
     def filter(self) -> pyrogram.filters.Filter:
         _filter = CustomFilters.callback_data(self)
 
@@ -24,8 +34,15 @@ class CallbackAction(str):
 
     def pack(self, data: dict = None) -> str:
         data = data or {}
+
+        if self.schema is not None:
+            return self.schema.pack(data)
+
         return CallbackData.pack(self, data)
 
+    def unpack(self, cq: pyrogram.types.CallbackQuery) -> dict:
+        return CallbackData.unpack(cq)
+
     def __invert__(self):
         return self.filter.__invert__()
 
@@ -42,18 +59,17 @@ class CallbackAction(str):
             admin: bool = None,
             state: str = '*'
     ):
-        _filter = self.filter
+        _filter = combine_filters(
+            CustomFilters.admin if self.admin or admin else None,
+            custom_filter,
+        )
+        action = self
 
-        if custom_filter is not None:
-            _filter = custom_filter & _filter
-
-        if state != '*':
-            _filter = CustomFilters.state(state) & _filter
-
-        if not self.admin and admin:
-            _filter = CustomFilters.admin & _filter
+        def decorator(func: callable):
+            command_router.add_callback_route(func, action, _filter, group, state)
+            return func
 
-        return pyrogram.Client.on_callback_query(_filter, group=group)
+        return decorator
 
 
 class CallbackActions:
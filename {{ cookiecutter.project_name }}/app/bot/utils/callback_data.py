@@ -1,3 +1,10 @@
+import base64
+import logging
+import re
+from typing import (
+    Any,
+    Optional,
+)
 from urllib.parse import (
     parse_qsl,
     urlencode,
@@ -6,21 +13,253 @@ from urllib.parse import (
 
 import pyrogram
 
+logger = logging.getLogger('CallbackData')
+
+# Telegram limit for InlineKeyboardButton.callback_data
+MAX_CALLBACK_DATA_SIZE = 64
+FIELD_TYPES = (int, str, bool)
+
+TEXT_SEPARATOR = ':'
+BINARY_SEPARATOR = '.'
+LEGACY_SEPARATOR = '?'
+# "%" is always escaped in text values, so a single "%" can't be confused with a string
+TEXT_NONE = '%'
+
+_separator_re = re.compile(r'[?:.]')
+
+
+def check_size(data: str) -> str:
+    size = len(data.encode('utf-8'))
+
+    if size > MAX_CALLBACK_DATA_SIZE:
+        raise ValueError(f"Callback data {data!r} is {size} bytes long, max size is {MAX_CALLBACK_DATA_SIZE} bytes")
+
+    return data
+
+
+def _escape(value: str) -> str:
+    return value.replace('%', '%25').replace(TEXT_SEPARATOR, '%3A')
+
+
+def _unescape(value: str) -> str:
+    return value.replace('%3A', TEXT_SEPARATOR).replace('%25', '%') if '%' in value else value
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+
+        if value == 0:
+            buffer.append(byte)
+            return
+
+        buffer.append(byte | 0x80)
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return result, position
+
+
+# Positional layout of callback data for a short action id, values are packed in order of fields.
+# Text layout is "action:1:foo:0", binary layout is "action." followed by base85 encoded varints and strings
+class CallbackSchema:
+    def __init__(self, action: str, fields: dict[str, type], *, binary: bool = False):
+        if _separator_re.search(action):
+            raise ValueError(f"Callback action {action!r} must not contain any of '?', ':', '.'")
+
+        for name, field_type in fields.items():
+            if field_type not in FIELD_TYPES:
+                raise ValueError(f"Unsupported type of callback data field {name}: {field_type}")
+
+        self.action = action
+        self.fields = dict(fields)
+        self.binary = binary
+        self._types = tuple(self.fields.values())
+        CallbackData.register(self)
+
+    def __repr__(self) -> str:
+        return f"CallbackSchema(action={self.action!r}, fields={self.fields!r}, binary={self.binary})"
+
+    def __eq__(self, other: Any) -> bool:
+        return (
+            isinstance(other, CallbackSchema)
+            and (self.action, self.fields, self.binary) == (other.action, other.fields, other.binary)
+        )
+
+    def __hash__(self) -> int:
+        return hash(self.action)
+
+    def pack(self, data: dict = None) -> str:
+        data = data or {}
+        values = [data.get(name) for name in self.fields]
+
+        if self.binary:
+            packed = f"{self.action}{BINARY_SEPARATOR}{self._pack_binary(values)}"
+        else:
+            packed = f"{self.action}{TEXT_SEPARATOR}{self._pack_text(values)}"
+
+        return check_size(packed)
+
+    def unpack(self, data: str) -> dict:
+        separator, payload = data[len(self.action)], data[len(self.action) + 1:]
+        values = self._unpack_binary(payload) if separator == BINARY_SEPARATOR else self._unpack_text(payload)
+        return dict(zip(self.fields, values))
+
+    def button(self, text: str, data: dict = None, **kwargs) -> pyrogram.types.InlineKeyboardButton:
+        return pyrogram.types.InlineKeyboardButton(text, self.pack(data), **kwargs)
+
+    def _pack_text(self, values: list) -> str:
+        parts = []
+
+        for field_type, value in zip(self._types, values):
+            if value is None:
+                parts.append(TEXT_NONE if field_type is str else '')
+            elif field_type is bool:
+                parts.append('1' if value else '0')
+            elif field_type is int:
+                parts.append(str(int(value)))
+            else:
+                parts.append(_escape(str(value)))
+
+        return TEXT_SEPARATOR.join(parts)
+
+    def _unpack_text(self, payload: str) -> list:
+        parts = payload.split(TEXT_SEPARATOR)
+
+        if len(parts) != len(self._types):
+            raise ValueError(f"Expected {len(self._types)} values, got {len(parts)}")
+
+        values = []
+
+        for field_type, part in zip(self._types, parts):
+            if field_type is str:
+                values.append(_unescape(part) if part != TEXT_NONE else None)
+            elif part == '':
+                values.append(None)
+            elif field_type is bool:
+                values.append(part == '1')
+            else:
+                values.append(int(part))
+
+        return values
+
+    def _pack_binary(self, values: list) -> str:
+        buffer = bytearray()
+        # Bitmask of fields which are None
+        _write_varint(buffer, sum(1 << i for i, value in enumerate(values) if value is None))
+
+        for field_type, value in zip(self._types, values):
+            if value is None:
+                continue
+
+            if field_type is bool:
+                buffer.append(1 if value else 0)
+            elif field_type is int:
+                value = int(value)
+                # Zigzag encoding keeps small negative numbers short
+                _write_varint(buffer, value * 2 if value >= 0 else -value * 2 - 1)
+            else:
+                encoded = str(value).encode('utf-8')
+                _write_varint(buffer, len(encoded))
+                buffer += encoded
+
+        return base64.b85encode(bytes(buffer)).decode('ascii')
+
+    def _unpack_binary(self, payload: str) -> list:
+        try:
+            data = base64.b85decode(payload)
+            none_mask, position = _read_varint(data, 0)
+            values = []
+
+            for i, field_type in enumerate(self._types):
+                if none_mask & (1 << i):
+                    values.append(None)
+                elif field_type is bool:
+                    values.append(data[position] == 1)
+                    position += 1
+                elif field_type is int:
+                    value, position = _read_varint(data, position)
+                    values.append(value // 2 if value % 2 == 0 else -(value + 1) // 2)
+                else:
+                    length, position = _read_varint(data, position)
+                    values.append(data[position:position + length].decode('utf-8'))
+                    position += length
+        except (IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed binary callback data. {e}")
+
+        return values
+
 
 class CallbackData:
+    schemas: dict[str, CallbackSchema] = {}
+
+    @classmethod
+    def register(cls, schema: CallbackSchema):
+        registered = cls.schemas.get(schema.action)
+
+        if registered is not None and registered != schema:
+            raise ValueError(f"Callback action {schema.action!r} is already registered as {registered!r}")
+
+        cls.schemas[schema.action] = schema
+
+    @classmethod
+    def get_schema(cls, data: str) -> Optional[CallbackSchema]:
+        match = _separator_re.search(data)
+
+        if match is None or match.group() == LEGACY_SEPARATOR:
+            return None
+
+        return cls.schemas.get(data[:match.start()])
+
+    @classmethod
+    def get_action(cls, data: str) -> str:
+        schema = cls.get_schema(data)
+        return schema.action if schema is not None else data.split(LEGACY_SEPARATOR, 1)[0]
+
     @staticmethod
     def pack(callback_action: str, params: dict = None) -> str:
         if not params:
             params = {}
 
-        return f"{callback_action}?{urlencode(params)}"
+        return check_size(f"{callback_action}?{urlencode(params)}")
 
-    @staticmethod
-    def unpack(cq: pyrogram.types.CallbackQuery) -> dict:
-        parsed_data = urlparse(cq.data)
+    @classmethod
+    def parse(cls, data: str) -> dict:
+        schema = cls.get_schema(data)
+
+        if schema is not None:
+            try:
+                return schema.unpack(data)
+            except ValueError as e:
+                logger.warning(f"Unable to unpack callback data {data!r} with {schema!r}. {e}")
+                return {}
+
+        parsed_data = urlparse(data)
         params = {}
 
         if parsed_data and parsed_data.query:
             params = dict(parse_qsl(parsed_data.query))
 
         return params
+
+    @classmethod
+    def unpack(cls, cq: pyrogram.types.CallbackQuery) -> dict:
+        # Parsed once per update, handlers and filters share the result
+        params = getattr(cq.bucket, 'callback_data', None)
+
+        if params is None:
+            params = cls.parse(cq.data or '')
+            cq.bucket.callback_data = params
+
+        return params
@@ -12,6 +12,10 @@ import pyrogram
 from pyrogram.types import BotCommand
 
 from app.bot.utils.custom_filters import CustomFilters
+from app.bot.utils.router import (
+    combine_filters,
+    command_router,
+)
 
 
 class CommandArgs(pydantic.BaseModel):
@@ -74,27 +78,15 @@ class ChatCommand:
                 else args_model
             )
 
-        _filter = self.filter
-
-        if custom_filter is not None:
-            _filter = custom_filter & _filter
-
-        if state != '*':
-            _filter = CustomFilters.state(state) & _filter
-
-        if not self.admin and admin:
-            _filter = CustomFilters.admin & _filter
-
-        if not self.private and private:
-            _filter = pyrogram.filters.private & _filter
-
-        if not self.reply and reply:
-            _filter = pyrogram.filters.reply & _filter
-
+        _filter = combine_filters(
+            CustomFilters.admin if self.admin or admin else None,
+            pyrogram.filters.private if self.private or private else None,
+            pyrogram.filters.reply if self.reply or reply else None,
+            custom_filter,
+        )
         command = self
 
         def decorator(func: callable):
-            @pyrogram.Client.on_message(_filter, group=group)
             async def decorated(_, message: pyrogram.types.Message):
                 try:
                     message.bucket.args = await command.parse_args(message.command[1:])
@@ -104,11 +96,12 @@ class ChatCommand:
 
                 await func(_, message)
 
+            command_router.add_command_route(decorated, command.command, command.prefix, _filter, group, state)
             return decorated
 
         return decorator
 
-    @property
+    @cached_property
     def filter(self) -> pyrogram.filters.Filter:
         _filter = pyrogram.filters.all
 
@@ -268,3 +261,8 @@ class PrivateCommands(BaseCommandsSet):
     PROMOTE_SELF = ChatCommand('promoteself', description='Promote self to be an admin with secret code', hidden=True)
     PROMOTE = ChatCommand('promote', description='Promote user to be an admin', admin=True)
     ANNOUNCE = ChatCommand('announce', description='Forward replied message to users', admin=True)
+    BROADCAST_STATUS = ChatCommand('broadcaststatus', description='Show status of broadcast job', admin=True)
+    BROADCAST_PAUSE = ChatCommand('broadcastpause', description='Pause broadcast job', admin=True)
+    BROADCAST_RESUME = ChatCommand('broadcastresume', description='Resume paused broadcast job', admin=True)
+    STATE_REPORT = ChatCommand('statereport', description='Show user states count and memory usage', admin=True)
+    DB_STATS = ChatCommand('dbstats', description='Show database pool and query stats', admin=True)
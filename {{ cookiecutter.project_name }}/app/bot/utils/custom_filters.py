@@ -9,7 +9,7 @@ from typing import (
 import pyrogram
 from pyrogram import filters
 
-from app.bot.middlewares.user_state import UserState
+from app.bot.middlewares.user_state import LazyUserState
 
 logger = logging.getLogger('CustomFilters')
 
@@ -23,26 +23,25 @@ def _check_admin(_, __, update: Union[pyrogram.types.Message, pyrogram.types.Cal
     return getattr(user, 'is_admin', False)
 
 
-def _check_cq_regex(f, _, cq: pyrogram.types.CallbackQuery):
-    return bool(re.match(fr"^({f.data}|{f.data}\?.*)$", cq.data, re.IGNORECASE))
+async def _check_cq_regex(f, _, cq: pyrogram.types.CallbackQuery):
+    return bool(f.pattern.match(cq.data))
 
 
-def _check_state(f, _, update: Union[pyrogram.types.Message, pyrogram.types.CallbackQuery]):
+async def _check_state(f, _, update: Union[pyrogram.types.Message, pyrogram.types.CallbackQuery]):
     if not isinstance(update, (pyrogram.types.Message, pyrogram.types.CallbackQuery)):
         return True
 
-    check_states = f.state if isinstance(f.state, list) else [f.state]
-
-    if '*' in check_states:
+    if '*' in f.states:
         return True
 
-    state: UserState = update.bucket.state
+    lazy_state: LazyUserState = getattr(update.bucket, 'state', None)
 
-    if state is None:
+    if lazy_state is None:
         logger.warning("User state is None! You probably disabled user_state middleware!")
         return False
 
-    return state.name in check_states
+    state = await lazy_state
+    return state.name in f.states
 
 
 class CustomFilters:
@@ -50,8 +49,10 @@ class CustomFilters:
 
     @staticmethod
     def callback_data(regex: str) -> filters.Filter:
-        return filters.create(_check_cq_regex, "CallbackDataRegexFilter", data=regex)
+        pattern = re.compile(fr"^({regex}|{regex}[?:.].*)$", re.IGNORECASE)
+        return filters.create(_check_cq_regex, "CallbackDataRegexFilter", data=regex, pattern=pattern)
 
     @staticmethod
     def state(state: Union[Optional[str], List[Optional[str]]] = '*') -> filters.Filter:
-        return filters.create(_check_state, "CheckUserState", state=state)
+        states = frozenset(state if isinstance(state, list) else [state])
+        return filters.create(_check_state, "CheckUserState", state=state, states=states)
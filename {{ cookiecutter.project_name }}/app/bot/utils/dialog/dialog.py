@@ -1,8 +1,5 @@
 import abc
 import uuid
-from functools import (
-    cached_property,
-)
 from typing import (
     Optional,
     Union,
@@ -11,74 +8,65 @@ from typing import (
 import pyrogram.filters
 
 from app.bot.middlewares.user_state import UserState
-from app.bot.utils.custom_filters import CustomFilters
+from app.bot.utils.router import dialog_router
+from app.settings import settings
 from .dialog_actions import DialogAction
 
 
 class Dialog:
+    state_ttl: int = settings.DIALOG_STATE_TTL
+    delta_state: bool = settings.DIALOG_DELTA_STATE
+    # Compiled once per subclass: ordered steps and step -> next step transitions, None is the initial step
+    _steps: dict[str, DialogAction] = {}
+    _transitions: dict[Optional[str], Optional[str]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._steps = {
+            k: v
+            for k, v in cls.__dict__.items()
+            if not (k.startswith('_') or k.startswith('__')) and isinstance(v, DialogAction)
+        }
+        steps_names = [None, *cls._steps.keys()]
+        cls._transitions = dict(zip(steps_names, [*steps_names[1:], None]))
+
     def __init__(self):
         self.__id = f"{self.__class__.__name__}_{uuid.uuid4().hex[:8]}"
+        # Same tables with state names, which are prefixed with dialog id
+        self.__actions: dict[str, DialogAction] = {self.__state_name(k): v for k, v in self._steps.items()}
+        self.__steps_names: dict[str, str] = {self.__state_name(k): k for k in self._steps.keys()}
+        self.__next_states: dict[Optional[str], Optional[str]] = {
+            self.__state_name(k): self.__state_name(v)
+            for k, v in self._transitions.items()
+        }
 
     def register(self, client: pyrogram.Client, group: int = 50):
-        client.add_handler(pyrogram.handlers.MessageHandler(self.__process_update, self.__filter), group)
-        client.add_handler(pyrogram.handlers.CallbackQueryHandler(self.__process_update, self.__filter), group)
+        dialog_router.add_dialog(self.__id, [*self.__actions.keys(), None], self.__process_update, group)
+        dialog_router.register(client)
 
     async def start(self, update: Union[pyrogram.types.Message, pyrogram.types.CallbackQuery]):
-        state: UserState = update.bucket.state
-        await state.set(data={"_dialog_id": self.__id})
+        if self.delta_state:
+            # Answers of previous unfinished dialog could still be stored
+            await update.bucket.state.clear()
+
+        await update.bucket.state.set(data={"_dialog_id": self.__id}, ttl=self.state_ttl)
         await self.__process_update(None, update)
 
     @abc.abstractmethod
     async def on_finish(self, message: pyrogram.types.Message, final_data: dict):
         pass
 
-    @cached_property
-    def __actions(self) -> dict[str, DialogAction]:
-        return {
-            f'{self.__id}:{k}': v
-            for k, v in self.__class__.__dict__.items()
-            if not (k.startswith('_') or k.startswith('__')) and isinstance(v, DialogAction)
-        }
-
-    @property
-    def __dialog_id_filter(self) -> pyrogram.filters.Filter:
-        return pyrogram.filters.create(Dialog.__check_dialog_id, "DialogIdFilter", id=self.__id)
-
-    @property
-    def __filter(self) -> pyrogram.filters.Filter:
-        available_states = list(self.__actions.keys())
-        return self.__dialog_id_filter & CustomFilters.state([*available_states, None])
+    def __state_name(self, step_name: Optional[str]) -> Optional[str]:
+        return f'{self.__id}:{step_name}' if step_name is not None else None
 
     def __find_action_by_state(self, state: str) -> DialogAction:
         return self.__actions[state]
 
-    def __get_next_state(self, state_name: str) -> Optional[str]:
-        actions_keys = list(self.__actions.keys())
-
-        if state_name is None and len(actions_keys) > 0:
-            return actions_keys[0]
-
-        current_found = False
-
-        for i, k in enumerate(actions_keys):
-            if current_found:
-                return k
-
-            if k == state_name:
-                current_found = True
-
-        return None
-
-    @staticmethod
-    async def __check_dialog_id(f, __, update: Union[pyrogram.types.Message, pyrogram.types.CallbackQuery]):
-        if not isinstance(update, (pyrogram.types.Message, pyrogram.types.CallbackQuery)):
-            return False
-
-        state: UserState = update.bucket.state
-        return state.data is None or state.data.get('_dialog_id') == f.id
+    def __get_next_state(self, state_name: Optional[str]) -> Optional[str]:
+        return self.__next_states.get(state_name)
 
     async def __process_update(self, _, update: Union[pyrogram.types.Message, pyrogram.types.CallbackQuery]):
-        state: UserState = update.bucket.state
+        state: UserState = await update.bucket.state
         state_data = state.data
 
         if state_data is None:
@@ -89,7 +77,7 @@ class Dialog:
 
         if state.name is not None:
             current_action = self.__find_action_by_state(state.name)
-            original_action_name = state.name.replace(f'{self.__id}:', '', 1)
+            original_action_name = self.__steps_names[state.name]
 
             try:
                 update_data[original_action_name] = await current_action.parse_result(update)
@@ -100,13 +88,40 @@ class Dialog:
                 return message.continue_propagation()
 
         next_action_state_name = self.__get_next_state(state.name)
+
+        if self.delta_state:
+            await self.__process_delta_step(update, state, next_action_state_name, update_data)
+            return
+
         updated_state_data = state_data | update_data
 
         if bool(next_action_state_name):
             next_action = self.__find_action_by_state(next_action_state_name)
             await next_action(update)
-            await state.set(name=next_action_state_name, data=updated_state_data)
+            await state.set(name=next_action_state_name, data=updated_state_data, ttl=self.state_ttl)
         else:
             del updated_state_data['_dialog_id']
             await self.on_finish(message, updated_state_data)
             await state.clear()
+
+    async def __process_delta_step(
+            self,
+            update: Union[pyrogram.types.Message, pyrogram.types.CallbackQuery],
+            state: UserState,
+            next_action_state_name: Optional[str],
+            update_data: dict,
+    ):
+        # State keeps only dialog id and current step, answers are stored as separate fields
+        if bool(next_action_state_name):
+            if len(update_data) > 0:
+                await state.set_fields(update_data, ttl=self.state_ttl)
+
+            next_action = self.__find_action_by_state(next_action_state_name)
+            await next_action(update)
+            await state.set(name=next_action_state_name, data=state.data, ttl=self.state_ttl)
+        else:
+            answers = await state.get_fields() | update_data
+            final_data = {k: answers[k] for k in self._steps.keys() if k in answers}
+            message = update if isinstance(update, pyrogram.types.Message) else update.message
+            await self.on_finish(message, final_data)
+            await state.clear()
@@ -2,8 +2,11 @@ import abc
 import uuid
 from typing import (
     Any,
+    Callable,
+    Optional,
     Type,
     TypeVar,
+    Union,
 )
 
 import pydantic
@@ -11,9 +14,15 @@ import pydash
 import pyrogram.filters
 from pydantic import ValidationError
 
-from app.bot.utils.callback_data import CallbackData
+from app.bot.utils.callback_data import (
+    CallbackData,
+    CallbackSchema,
+)
+from app.utils.cache import LRUCache
+from . import validators
 from .types import (
     Choices,
+    ChoicesCacheKey,
     DialogChoice,
     DialogKeyboard,
     DialogSupportedUpdate,
@@ -22,6 +31,45 @@ from .types import (
 )
 
 ResultType = TypeVar('ResultType')
+_missing = object()
+
+
+# Keyboard of choices, which is built once for static choices.
+# Keyboards of callable choices are built on every render, or cached by key when cache_key is set
+class ChoicesMarkup:
+    def __init__(
+            self,
+            choices: Union[Choices, StrChoices],
+            build: Callable[[list], DialogKeyboard],
+            *,
+            cache_key: ChoicesCacheKey = None,
+            cache_ttl: float = 60,
+            cache_size: int = 1024,
+    ):
+        self.choices = choices
+        self.build = build
+        self.cache_key = cache_key
+        self.static_markup = None if callable(choices) else build(choices)
+        self.cache = LRUCache(cache_size, ttl=cache_ttl) if callable(choices) and cache_key is not None else None
+
+    async def get(self, update: DialogSupportedUpdate) -> DialogKeyboard:
+        if not callable(self.choices):
+            return self.static_markup
+
+        if self.cache is None:
+            return self.build(await self.choices(update))
+
+        key = self.cache_key(update)
+        markup = self.cache.get(key, _missing)
+
+        if markup is _missing:
+            markup = self.build(await self.choices(update))
+            self.cache.set(key, markup)
+
+        return markup
+
+    def stats(self) -> dict:
+        return self.cache.stats() if self.cache is not None else {}
 
 
 class DialogAction(abc.ABC):
@@ -43,24 +91,28 @@ class DialogAction(abc.ABC):
             regex: str = None,
     ):
         self.text = text
-        self.result_model = pydantic.create_model(
+        self.result_type = result_type
+        self.constraints = dict(
+            gt=gt,
+            ge=ge,
+            lt=lt,
+            le=le,
+            multiple_of=multiple_of,
+            max_digits=max_digits,
+            decimal_places=decimal_places,
+            min_length=min_length,
+            max_length=max_length,
+            regex=regex,
+        )
+        self.validator = validators.compile_validator(result_type, **self.constraints)
+        # Other result types are validated by pydantic model, it's created right away
+        # to fail early on constraints, which are not applicable to result type
+        self.result_model = self.create_result_model() if self.validator is None else None
+
+    def create_result_model(self) -> Type[pydantic.BaseModel]:
+        return pydantic.create_model(
             'DialogActionResultModel',
-            value=(
-                result_type,
-                pydantic.Field(
-                    ...,
-                    gt=gt,
-                    ge=ge,
-                    lt=lt,
-                    le=le,
-                    multiple_of=multiple_of,
-                    max_digits=max_digits,
-                    decimal_places=decimal_places,
-                    min_length=min_length,
-                    max_length=max_length,
-                    regex=regex,
-                )
-            ),
+            value=(self.result_type, pydantic.Field(..., **self.constraints)),
         )
 
     async def parse_result(self, update: DialogSupportedUpdate) -> ResultType:
@@ -69,6 +121,12 @@ class DialogAction(abc.ABC):
 
         result = await self.get_result_from_update(update)
 
+        if self.validator is not None:
+            try:
+                return self.validator(result)
+            except ValueError as e:
+                raise ValueError(str(e).capitalize())
+
         try:
             return self.result_model(value=result).value
         except ValidationError as e:
@@ -130,21 +188,34 @@ class DialogActionText(DialogMessageAction):
 
 
 class DialogActionReplySelect(DialogActionText):
-    def __init__(self, text: DialogText, choices: StrChoices, columns: int = 3):
+    def __init__(
+            self,
+            text: DialogText,
+            choices: StrChoices,
+            columns: int = 3,
+            choices_cache_key: ChoicesCacheKey = None,
+            choices_cache_ttl: float = 60,
+            choices_cache_size: int = 1024,
+    ):
         super().__init__(text)
         self.choices = choices
         self.columns = columns
+        self.markup = ChoicesMarkup(
+            choices,
+            self.build_reply_markup,
+            cache_key=choices_cache_key,
+            cache_ttl=choices_cache_ttl,
+            cache_size=choices_cache_size,
+        )
 
-    async def get_reply_markup(self, update: DialogSupportedUpdate) -> pyrogram.types.ReplyKeyboardMarkup:
-        if callable(self.choices):
-            choices = await self.choices(update)
-        else:
-            choices = self.choices
-
+    def build_reply_markup(self, choices: list[str]) -> pyrogram.types.ReplyKeyboardMarkup:
         rows = pydash.chunk(choices, self.columns)
 
         return pyrogram.types.ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
 
+    async def get_reply_markup(self, update: DialogSupportedUpdate) -> pyrogram.types.ReplyKeyboardMarkup:
+        return await self.markup.get(update)
+
 
 class DialogActionList(DialogActionText):
     async def get_result_from_update(self, update: pyrogram.types.Message) -> Any:
@@ -152,37 +223,59 @@ class DialogActionList(DialogActionText):
 
 
 class DialogActionInlineSelect(DialogCallbackQueryAction):
-    def __init__(self, text: DialogText, choices: Choices, result_type: Type[ResultType] = str, columns: int = 1):
+    def __init__(
+            self,
+            text: DialogText,
+            choices: Choices,
+            result_type: Type[ResultType] = str,
+            columns: int = 1,
+            compact_callback_data: bool = False,
+            choices_cache_key: ChoicesCacheKey = None,
+            choices_cache_ttl: float = 60,
+            choices_cache_size: int = 1024,
+    ):
         super().__init__(text, result_type=result_type)
         self.action = uuid.uuid4().hex[:7]
         self.choices = choices
         self.columns = columns
+        self.callback_schema = CallbackSchema(self.action, {'v': str}) if compact_callback_data else None
+        self.markup = ChoicesMarkup(
+            choices,
+            self.build_reply_markup,
+            cache_key=choices_cache_key,
+            cache_ttl=choices_cache_ttl,
+            cache_size=choices_cache_size,
+        )
 
-    async def get_result_from_update(self, update: pyrogram.types.CallbackQuery) -> Any:
-        return update.params.get('v')
+    def pack_choice(self, choice: DialogChoice) -> str:
+        if self.callback_schema is not None:
+            return self.callback_schema.pack({'v': choice.value})
 
-    async def get_reply_markup(self, update: DialogSupportedUpdate) -> DialogKeyboard:
-        if callable(self.choices):
-            choices = await self.choices(update)
-        else:
-            choices = self.choices
+        return CallbackData.pack(self.action, {"v": choice.value})
 
+    async def get_result_from_update(self, update: pyrogram.types.CallbackQuery) -> Any:
+        return CallbackData.unpack(update).get('v')
+
+    def build_reply_markup(self, choices: list[DialogChoice]) -> Optional[pyrogram.types.InlineKeyboardMarkup]:
         if len(choices) == 0:
             return None
 
         buttons = pydash.chunk([
             pyrogram.types.InlineKeyboardButton(
                 c.title,
-                callback_data=CallbackData.pack(self.action, {"v": c.value})
+                callback_data=self.pack_choice(c)
             )
             for c in choices
         ], self.columns)
 
         return pyrogram.types.InlineKeyboardMarkup(buttons)
 
+    async def get_reply_markup(self, update: DialogSupportedUpdate) -> DialogKeyboard:
+        return await self.markup.get(update)
+
 
 class DialogActionBoolPrompt(DialogActionInlineSelect):
-    def __init__(self, text: DialogText):
+    def __init__(self, text: DialogText, compact_callback_data: bool = False):
         super().__init__(
             text=text,
             choices=[
@@ -190,5 +283,6 @@ class DialogActionBoolPrompt(DialogActionInlineSelect):
                 DialogChoice(title="Yes", value="1"),
             ],
             result_type=bool,
-            columns=2
+            columns=2,
+            compact_callback_data=compact_callback_data,
         )
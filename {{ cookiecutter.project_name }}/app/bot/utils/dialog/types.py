@@ -2,6 +2,7 @@ from typing import (
     Any,
     Callable,
     Coroutine,
+    Hashable,
     Optional,
     Union,
 )
@@ -27,3 +28,5 @@ DialogKeyboard = Optional[Union[
 # Union[T, Callable[[...], Coroutine[Any, Any, T]]]
 StrChoices = Union[list[str], Callable[[DialogSupportedUpdate], Coroutine[Any, Any, list[str]]]]
 Choices = Union[list[DialogChoice], Callable[[DialogSupportedUpdate], Coroutine[Any, Any, list[DialogChoice]]]]
+# Key of cached keyboard of callable choices, e.g. lambda update: update.from_user.language_code
+ChoicesCacheKey = Callable[[DialogSupportedUpdate], Hashable]
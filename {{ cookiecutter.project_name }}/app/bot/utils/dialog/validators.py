@@ -0,0 +1,178 @@
+import re
+import sys
+from decimal import Decimal
+from enum import Enum
+from typing import (
+    Any,
+    Callable,
+    Optional,
+)
+
+# Validators for common result types of dialog actions. They follow pydantic v1 validation rules
+# and raise ValueError with the same messages, so users see the same errors as with pydantic models
+
+Validator = Callable[[Any], Any]
+
+STR_CONSTRAINTS = frozenset({'min_length', 'max_length', 'regex'})
+NUMBER_CONSTRAINTS = frozenset({'gt', 'ge', 'lt', 'le', 'multiple_of'})
+
+BOOL_FALSE = {0, '0', 'off', 'f', 'false', 'n', 'no'}
+BOOL_TRUE = {1, '1', 'on', 't', 'true', 'y', 'yes'}
+
+
+def _none_not_allowed():
+    return ValueError('none is not an allowed value')
+
+
+def validate_str(v: Any) -> str:
+    if v is None:
+        raise _none_not_allowed()
+
+    if isinstance(v, str):
+        return v.value if isinstance(v, Enum) else v
+
+    if isinstance(v, (float, int, Decimal)):
+        return str(v)
+
+    if isinstance(v, (bytes, bytearray)):
+        return v.decode()
+
+    raise ValueError('str type expected')
+
+
+def validate_int(v: Any) -> int:
+    if v is None:
+        raise _none_not_allowed()
+
+    if isinstance(v, int) and not (v is True or v is False):
+        return v
+
+    try:
+        return int(v)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('value is not a valid integer')
+
+
+def validate_float(v: Any) -> float:
+    if v is None:
+        raise _none_not_allowed()
+
+    if isinstance(v, float):
+        return v
+
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        raise ValueError('value is not a valid float')
+
+
+def validate_bool(v: Any) -> bool:
+    if v is None:
+        raise _none_not_allowed()
+
+    if v is True or v is False:
+        return v
+
+    if isinstance(v, bytes):
+        v = v.decode()
+
+    if isinstance(v, str):
+        v = v.lower()
+
+    try:
+        if v in BOOL_TRUE:
+            return True
+
+        if v in BOOL_FALSE:
+            return False
+    except TypeError:
+        pass
+
+    raise ValueError('value could not be parsed to a boolean')
+
+
+def _almost_equal_floats(value_1: float, value_2: float) -> bool:
+    return abs(value_1 - value_2) <= sys.float_info.epsilon
+
+
+def compile_str_validator(min_length: int = None, max_length: int = None, regex: str = None) -> Validator:
+    if min_length is None and max_length is None and regex is None:
+        return validate_str
+
+    pattern = re.compile(regex) if regex is not None else None
+
+    def validator(v: Any) -> str:
+        v = validate_str(v)
+        v_len = len(v)
+
+        if min_length is not None and v_len < min_length:
+            raise ValueError(f'ensure this value has at least {min_length} characters')
+
+        if max_length is not None and v_len > max_length:
+            raise ValueError(f'ensure this value has at most {max_length} characters')
+
+        if pattern is not None and not pattern.match(v):
+            raise ValueError(f'string does not match regex "{pattern.pattern}"')
+
+        return v
+
+    return validator
+
+
+def compile_number_validator(
+        type_validator: Validator,
+        gt: float = None,
+        ge: float = None,
+        lt: float = None,
+        le: float = None,
+        multiple_of: float = None,
+) -> Validator:
+    if gt is None and ge is None and lt is None and le is None and multiple_of is None:
+        return type_validator
+
+    def validator(v: Any) -> Any:
+        v = type_validator(v)
+
+        if gt is not None and not v > gt:
+            raise ValueError(f'ensure this value is greater than {gt}')
+        elif ge is not None and not v >= ge:
+            raise ValueError(f'ensure this value is greater than or equal to {ge}')
+
+        if lt is not None and not v < lt:
+            raise ValueError(f'ensure this value is less than {lt}')
+
+        if le is not None and not v <= le:
+            raise ValueError(f'ensure this value is less than or equal to {le}')
+
+        if multiple_of is not None:
+            mod = float(v) / float(multiple_of) % 1
+
+            if not _almost_equal_floats(mod, 0.0) and not _almost_equal_floats(mod, 1.0):
+                raise ValueError(f'ensure this value is a multiple of {multiple_of}')
+
+        return v
+
+    return validator
+
+
+def compile_validator(result_type: Any, **constraints: Any) -> Optional[Validator]:
+    # Returns None when result type or constraints are not supported, pydantic should be used then
+    used_constraints = {k: v for k, v in constraints.items() if v is not None}
+
+    # pydantic refuses such bounds with ConfigError
+    if {'gt', 'ge'} <= used_constraints.keys() or {'lt', 'le'} <= used_constraints.keys():
+        return None
+
+    if result_type is str and used_constraints.keys() <= STR_CONSTRAINTS:
+        return compile_str_validator(**used_constraints)
+
+    if result_type is int and used_constraints.keys() <= NUMBER_CONSTRAINTS:
+        return compile_number_validator(validate_int, **used_constraints)
+
+    if result_type is float and used_constraints.keys() <= NUMBER_CONSTRAINTS:
+        return compile_number_validator(validate_float, **used_constraints)
+
+    if result_type is bool and len(used_constraints) == 0:
+        return validate_bool
+
+    return None
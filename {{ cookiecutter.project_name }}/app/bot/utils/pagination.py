@@ -8,6 +8,7 @@ from typing import (
     Optional,
     Union,
 )
+from urllib.parse import urlencode
 
 import async_lru
 import peewee
@@ -17,18 +18,98 @@ from pyrogram.errors import (
     MessageNotModified,
 )
 
+from app.bot.utils.callback_data import CallbackSchema
 from app.database.database import objects
+from app.settings import settings
+from app.utils import json
+from app.utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
+# Keyset pagination cursors: after key, before key, from key (inclusive) and the last page
+CURSOR_AFTER = 'a'
+CURSOR_BEFORE = 'b'
+CURSOR_FROM = 'i'
+CURSOR_LAST = 'l'
+CURSOR_KINDS = (CURSOR_AFTER, CURSOR_BEFORE, CURSOR_FROM, CURSOR_LAST)
+# Values of compound keys are joined as is, the separator is not escaped in urls and text callback data,
+# so the cursor fits into 64 bytes of callback data with a datetime and primary key
+CURSOR_SEPARATOR = '~'
+
+# Total count strategies: COUNT(*) query, COUNT(*) OVER() in the page query,
+# planner estimate from EXPLAIN or COUNT(*) cached by query SQL across Pagination instances
+COUNT_EXACT = 'count'
+COUNT_WINDOW = 'window'
+COUNT_ESTIMATE = 'estimate'
+COUNT_CACHED = 'cached'
+COUNT_STRATEGIES = (COUNT_EXACT, COUNT_WINDOW, COUNT_ESTIMATE, COUNT_CACHED)
+WINDOW_COUNT_ALIAS = 'pagination_total_count'
+
+count_cache = LRUCache(settings.PAGINATION_COUNT_CACHE_SIZE, ttl=settings.PAGINATION_COUNT_CACHE_TTL)
+
 ItemSerializer = Callable[[peewee.Model], Coroutine[Any, Any, str]]
+# Serializes all rows of a page at once, so related data could be loaded with a single query
+ItemsSerializer = Callable[[list[peewee.Model]], Coroutine[Any, Any, list[str]]]
+ItemsPrefetcher = Callable[[list[peewee.Model]], Coroutine[Any, Any, None]]
 ItemMarkupMaker = Callable[[peewee.Model], Coroutine[Any, Any, list[list[pyrogram.types.InlineKeyboardButton]]]]
 
 
+def escape_cursor_value(value: str) -> str:
+    return value.replace('%', '%25').replace(CURSOR_SEPARATOR, '%7E')
+
+
+def unescape_cursor_value(value: str) -> str:
+    return value.replace('%7E', CURSOR_SEPARATOR).replace('%25', '%') if '%' in value else value
+
+
 async def to_string(item: peewee.Model) -> str:
     return str(item)
 
 
+def prefetch_foreign_keys(*fields: peewee.ForeignKeyField) -> ItemsPrefetcher:
+    # Loads related rows of page items with one query per foreign key instead of one per item
+    async def prefetcher(items: list[peewee.Model]):
+        for field in fields:
+            ids = {item.__data__.get(field.name) for item in items} - {None}
+
+            if len(ids) == 0:
+                continue
+
+            related = await objects.execute(field.rel_model.select().where(field.rel_field.in_(list(ids))))
+            related_by_id = {getattr(r, field.rel_field.name): r for r in related}
+
+            for item in items:
+                related_item = related_by_id.get(item.__data__.get(field.name))
+
+                if related_item is not None:
+                    setattr(item, field.name, related_item)
+
+    return prefetcher
+
+
+async def estimate_count(query: peewee.Query) -> int:
+    sql, params = query.sql()
+    explain_query = query.model.raw(f"EXPLAIN (FORMAT JSON) {sql}", *params).tuples()
+    plan = (await objects.execute(explain_query))[0][0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+async def cached_count(query: peewee.Query) -> int:
+    sql, params = query.sql()
+    key = (sql, repr(params))
+    total_count = count_cache.get(key)
+
+    if total_count is None:
+        total_count = await objects.count(query)
+        count_cache.set(key, total_count)
+
+    return total_count
+
+
 class Pagination:
     def __init__(
             self,
@@ -43,7 +124,28 @@ class Pagination:
             hide_fast_forward: bool = False,
             fast_forward_min_pages: int = 10,
             separator: str = "\n\n",
+            callback_schema: CallbackSchema = None,
+            callback_params: dict = None,
+            keyset: bool = False,
+            keyset_field: peewee.Field = None,
+            keyset_desc: bool = False,
+            cursor: str = None,
+            count_strategy: str = 'count',
+            items_serializer: ItemsSerializer = None,
+            prefetch: ItemsPrefetcher = None,
     ):
+        if count_strategy not in COUNT_STRATEGIES:
+            raise ValueError(f"Unknown count strategy {count_strategy}. Available: {', '.join(COUNT_STRATEGIES)}")
+
+        if keyset and count_strategy == COUNT_WINDOW:
+            raise ValueError("Window count strategy is not available in keyset mode, use cached or estimate instead")
+
+        if callback_schema is not None and callback_schema.fields.get('p') is not int:
+            raise ValueError("Pagination callback schema must have int field 'p' for page number")
+
+        if keyset and callback_schema is not None and callback_schema.fields.get('c') is not str:
+            raise ValueError("Pagination callback schema must have str field 'c' for cursor in keyset mode")
+
         self.command = command
         self.query = query
         self.page_size = page_size
@@ -54,6 +156,22 @@ class Pagination:
         self.fast_forward_min_pages = fast_forward_min_pages
         self.item_serializer = item_serializer
         self.item_keyboard_maker = item_keyboard_maker
+        self.items_serializer = items_serializer
+        self.prefetch = prefetch
+        self.callback_schema = callback_schema
+        self.callback_params = callback_params or {}
+        # Keyset mode seeks pages by ordering column value from cursor instead of OFFSET
+        self.keyset = keyset
+        self.keyset_field = keyset_field or query.model._meta.primary_key
+        # Rows with the same value of non-unique field are told apart by primary key
+        self.keyset_fields = (
+            (self.keyset_field,)
+            if self.keyset_field.primary_key or self.keyset_field.unique
+            else (self.keyset_field, query.model._meta.primary_key)
+        )
+        self.keyset_desc = keyset_desc
+        self.cursor_kind, self.cursor_value = self.parse_cursor(cursor) if keyset else (None, None)
+        self.count_strategy = count_strategy
 
         try:
             self.page = abs(int(page))
@@ -64,54 +182,250 @@ class Pagination:
     def is_single_page(self):
         return self.page_size == 1
 
+    @property
+    def is_total_estimated(self) -> bool:
+        return self.count_strategy == COUNT_ESTIMATE
+
+    @async_lru.alru_cache
+    async def get_total_count(self) -> int:
+        if self.count_strategy == COUNT_WINDOW:
+            _, _, total_count = await self.fetch_window_page()
+            return total_count
+
+        if self.count_strategy == COUNT_ESTIMATE:
+            return await estimate_count(self.query)
+
+        if self.count_strategy == COUNT_CACHED:
+            return await cached_count(self.query)
+
+        return await objects.count(self.query)
+
     @async_lru.alru_cache
     async def get_total_pages(self) -> int:
-        total_count = await objects.count(self.query)
-        return max(1, math.ceil(total_count / self.page_size))
+        total_count = await self.get_total_count()
+        total_pages = max(1, math.ceil(total_count / self.page_size))
+
+        if self.is_total_estimated and self.cursor_kind != CURSOR_LAST:
+            # Estimate could be lower than actual count, next page is kept reachable while pages are full
+            page = await self.get_page()
+
+            if page >= total_pages and len(await self.get_items()) == self.page_size:
+                total_pages = page + 1
+
+        return total_pages
+
+    async def get_total_pages_text(self) -> str:
+        total_pages = await self.get_total_pages()
+        return f"~{total_pages}" if self.is_total_estimated else f"{total_pages}"
 
     @async_lru.alru_cache
     async def get_page(self) -> int:
+        if self.keyset and self.cursor_kind is None:
+            return 1
+
+        if self.count_strategy == COUNT_WINDOW:
+            page, _, _ = await self.fetch_window_page()
+            return page
+
+        if self.is_total_estimated and self.cursor_kind != CURSOR_LAST:
+            return max(1, self.page)
+
         total_pages = await self.get_total_pages()
+
+        if self.cursor_kind == CURSOR_LAST:
+            return total_pages
+
         return min(max(1, self.page), total_pages)
 
+    def parse_cursor(self, cursor: Optional[str]) -> tuple[Optional[str], Any]:
+        if not cursor or cursor[0] not in CURSOR_KINDS:
+            return None, None
+
+        if cursor[0] == CURSOR_LAST:
+            return CURSOR_LAST, None
+
+        try:
+            if len(self.keyset_fields) == 1:
+                return cursor[0], self.keyset_field.adapt(cursor[1:])
+
+            values = [unescape_cursor_value(value) for value in cursor[1:].split(CURSOR_SEPARATOR)]
+
+            if len(values) != len(self.keyset_fields):
+                return None, None
+
+            return cursor[0], tuple(field.adapt(value) for field, value in zip(self.keyset_fields, values))
+        except (TypeError, ValueError):
+            return None, None
+
+    def get_cursor(self, kind: str, key: Any) -> str:
+        if len(self.keyset_fields) == 1:
+            return f"{kind}{key}"
+
+        return kind + CURSOR_SEPARATOR.join(escape_cursor_value(str(value)) for value in key)
+
+    def get_item_key(self, item: peewee.Model) -> Any:
+        if len(self.keyset_fields) == 1:
+            return item.__data__.get(self.keyset_field.name)
+
+        return tuple(item.__data__.get(field.name) for field in self.keyset_fields)
+
+    @property
+    def is_reversed_seek(self) -> bool:
+        return self.cursor_kind in (CURSOR_BEFORE, CURSOR_LAST)
+
+    def get_page_query(self, page: int) -> peewee.Query:
+        if not self.keyset:
+            return self.query.paginate(page, self.page_size)
+
+        if len(self.keyset_fields) == 1:
+            field, value = self.keyset_field, self.cursor_value
+        else:
+            # Row value comparison, so (field, primary key) is compared as a whole
+            field = peewee.Tuple(*self.keyset_fields)
+            value = peewee.Tuple(*self.cursor_value) if self.cursor_value is not None else None
+
+        query = self.query
+
+        if self.cursor_kind == CURSOR_AFTER:
+            query = query.where(field < value if self.keyset_desc else field > value)
+        elif self.cursor_kind == CURSOR_FROM:
+            query = query.where(field <= value if self.keyset_desc else field >= value)
+        elif self.cursor_kind == CURSOR_BEFORE:
+            query = query.where(field > value if self.keyset_desc else field < value)
+
+        # Pages before cursor and the last page are selected in reversed order and flipped back
+        descending = self.keyset_desc != self.is_reversed_seek
+        order_by = [f.desc() if descending else f.asc() for f in self.keyset_fields]
+        return query.order_by(*order_by).limit(self.page_size)
+
+    @async_lru.alru_cache
+    async def fetch_window_page(self) -> tuple[int, list[peewee.Model], int]:
+        # Page rows and total count in one query, page is clamped afterwards only when it's out of range
+        page = max(1, self.page)
+        window_count = peewee.fn.COUNT(peewee.SQL('*')).over().alias(WINDOW_COUNT_ALIAS)
+        items = list(await objects.execute(self.get_page_query(page).select_extend(window_count)))
+
+        if len(items) > 0:
+            return page, items, getattr(items[0], WINDOW_COUNT_ALIAS)
+
+        total_count = await objects.count(self.query)
+        last_page = max(1, math.ceil(total_count / self.page_size))
+
+        if total_count > 0 and page > last_page:
+            page = last_page
+            items = list(await objects.execute(self.get_page_query(page)))
+
+        return page, items, total_count
+
+    async def fetch_items(self) -> list[peewee.Model]:
+        if self.count_strategy == COUNT_WINDOW:
+            _, items, _ = await self.fetch_window_page()
+            return items
+
+        page = await self.get_page()
+        items = list(await objects.execute(self.get_page_query(page)))
+        return items[::-1] if self.keyset and self.is_reversed_seek else items
+
+    @async_lru.alru_cache
+    async def get_items(self) -> list[peewee.Model]:
+        # Page rows are fetched once and shared by text, navigation and item keyboard
+        items = await self.fetch_items()
+
+        if self.prefetch is not None and len(items) > 0:
+            await self.prefetch(items)
+
+        return items
+
     async def get_text(self) -> str:
         _text = f"{self.header}\n\n" if self.header else ""
-        page = await self.get_page()
+        items = await self.get_items()
+
+        if self.items_serializer is not None:
+            items_strings = await self.items_serializer(items)
+        else:
+            items_strings = await asyncio.gather(*[self.item_serializer(item) for item in items])
 
-        query = self.query.paginate(page, self.page_size)
-        items = await objects.execute(query)
-        items_strings = await asyncio.gather(*[self.item_serializer(item) for item in items])
         _text += self.separator.join(items_strings) or "Nothing to show"
 
         return _text
 
-    async def get_reply_markup(self) -> Optional[pyrogram.types.InlineKeyboardMarkup]:
-        command = self.command.lower()
+    def get_page_callback_data(self, page: int, cursor: str = None) -> str:
+        if self.callback_schema is not None:
+            data = {**self.callback_params, 'p': page}
 
-        total_pages = await self.get_total_pages()
-        page = await self.get_page()
+            if self.keyset:
+                data['c'] = cursor
+
+            return self.callback_schema.pack(data)
+
+        command = self.command.lower()
 
         if '?' in command:
             command = command + "&"
         elif not command.endswith("?"):
             command = command + "?"
 
+        if cursor is not None:
+            return f'{command}{urlencode({"p": page, "c": cursor})}'
+
+        return f'{command}p={page}'
+
+    async def get_navigation(self) -> tuple[str, str, str, str, str]:
+        # Callback data of prev, current, next, first and last page buttons
+        total_pages = await self.get_total_pages()
+        page = await self.get_page()
+
         next_page = 1 if page + 1 > total_pages else page + 1
         prev_page = total_pages if page - 1 < 1 else page - 1
 
+        if not self.keyset:
+            return (
+                self.get_page_callback_data(prev_page),
+                self.get_page_callback_data(page),
+                self.get_page_callback_data(next_page),
+                self.get_page_callback_data(1),
+                self.get_page_callback_data(total_pages),
+            )
+
+        items = await self.get_items()
+        first_key = self.get_item_key(items[0]) if len(items) > 0 else None
+        last_key = self.get_item_key(items[-1]) if len(items) > 0 else None
+
+        return (
+            self.get_page_callback_data(
+                prev_page,
+                self.get_cursor(CURSOR_BEFORE, first_key) if page > 1 and first_key is not None else CURSOR_LAST,
+            ),
+            self.get_page_callback_data(
+                page,
+                self.get_cursor(CURSOR_FROM, first_key) if first_key is not None else None,
+            ),
+            self.get_page_callback_data(
+                next_page,
+                self.get_cursor(CURSOR_AFTER, last_key) if page < total_pages and last_key is not None else None,
+            ),
+            self.get_page_callback_data(1),
+            self.get_page_callback_data(total_pages, CURSOR_LAST),
+        )
+
+    async def get_reply_markup(self) -> Optional[pyrogram.types.InlineKeyboardMarkup]:
+        page = await self.get_page()
+        total_pages = await self.get_total_pages()
+        prev_data, current_data, next_data, first_data, last_data = await self.get_navigation()
+
         buttons = [
             [
                 pyrogram.types.InlineKeyboardButton(
                     text=pyrogram.emoji.REVERSE_BUTTON,
-                    callback_data=f'{command}p={prev_page}'
+                    callback_data=prev_data
                 ),
                 pyrogram.types.InlineKeyboardButton(
-                    text=f"{page} / {total_pages}",
-                    callback_data=f'{command}p={page}'
+                    text=f"{page} / {await self.get_total_pages_text()}",
+                    callback_data=current_data
                 ),
                 pyrogram.types.InlineKeyboardButton(
                     text=pyrogram.emoji.PLAY_BUTTON,
-                    callback_data=f'{command}p={next_page}'
+                    callback_data=next_data
                 ),
             ]
         ]
@@ -121,11 +435,11 @@ class Pagination:
                 [
                     pyrogram.types.InlineKeyboardButton(
                         text=pyrogram.emoji.FAST_REVERSE_BUTTON,
-                        callback_data=f'{command}p={1}'
+                        callback_data=first_data
                     ),
                     pyrogram.types.InlineKeyboardButton(
                         text=pyrogram.emoji.FAST_FORWARD_BUTTON,
-                        callback_data=f'{command}p={total_pages}'
+                        callback_data=last_data
                     ),
                 ]
             )
@@ -150,8 +464,7 @@ class Pagination:
             raise ValueError("get_item method is available only when page_size=1")
 
         try:
-            query = self.query.paginate(self.page, self.page_size)
-            items = await objects.execute(query)
+            items = await self.get_items()
             return items[0]
         except IndexError:
             return None
@@ -165,7 +478,7 @@ class Pagination:
         message_author = update.from_user if is_message else update.message.from_user
 
         [total_pages, page, text, reply_markup] = await asyncio.gather(
-            self.get_total_pages(),
+            self.get_total_pages_text(),
             self.get_page(),
             self.get_text(),
             self.get_reply_markup(),
@@ -0,0 +1,277 @@
+import abc
+import inspect
+import logging
+import re
+from typing import (
+    Callable,
+    Hashable,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Type,
+    Union,
+)
+
+import pyrogram
+from pyrogram.handlers.handler import Handler
+
+from app.bot.middlewares.user_state import (
+    LazyUserState,
+    UserState,
+)
+from app.bot.utils.callback_data import CallbackData
+
+RouteKey = Hashable
+RoutesIndex = dict[RouteKey, 'RouteSet']
+StateSpec = Union[Optional[str], list[Optional[str]]]
+
+# Same arguments parsing as in pyrogram.filters.command
+command_args_re = re.compile(r"([\"'])(.*?)(?<!\\)\1|(\S+)")
+escaped_quote_re = re.compile(r"\\([\"'])")
+
+
+class Route(NamedTuple):
+    callback: Callable
+    filters: Optional[pyrogram.filters.Filter] = None
+
+
+# Routes of one key indexed by required user state. Lists of states also contain routes for any state,
+# so routes are checked in order of registration and a state is looked up once per key
+class RouteSet:
+    def __init__(self):
+        self.any_state: list[Route] = []
+        self.by_state: dict[Optional[str], list[Route]] = {}
+
+    def add(self, route: Route, states: Optional[frozenset[Optional[str]]] = None):
+        if states is None:
+            self.any_state.append(route)
+
+            for routes in self.by_state.values():
+                routes.append(route)
+
+            return
+
+        for state in states:
+            self.by_state.setdefault(state, list(self.any_state)).append(route)
+
+
+async def check_filter(flt: pyrogram.filters.Filter, client: pyrogram.Client, update: pyrogram.types.Update) -> bool:
+    # Same as pyrogram.handlers.handler.Handler.check
+    if inspect.iscoroutinefunction(flt.__call__):
+        return await flt(client, update)
+
+    return await client.loop.run_in_executor(client.executor, flt, client, update)
+
+
+def combine_filters(*filters: Optional[pyrogram.filters.Filter]) -> Optional[pyrogram.filters.Filter]:
+    result = None
+
+    for flt in filters:
+        if flt is not None:
+            result = flt if result is None else result & flt
+
+    return result
+
+
+async def _match_route(f, client: pyrogram.Client, update: pyrogram.types.Update) -> bool:
+    return await f.router.match(f.index, client, update)
+
+
+# Single pyrogram handler per update type and group, which looks up routes by key
+# instead of checking filters of every handler one by one
+class Router(abc.ABC):
+    def __init__(self, name: str = None):
+        self.name = name or self.__class__.__name__
+        self.logger = logging.getLogger(self.name)
+        self._client: Optional[pyrogram.Client] = None
+        self._routes: dict[int, dict[Type[Handler], RoutesIndex]] = {}
+
+    @abc.abstractmethod
+    async def get_route_keys(self, client: pyrogram.Client, update: pyrogram.types.Update) -> Iterable[RouteKey]:
+        raise NotImplementedError
+
+    def add_route(
+            self,
+            handler_type: Type[Handler],
+            callback: Callable,
+            keys: Iterable[RouteKey],
+            filters: pyrogram.filters.Filter = None,
+            group: int = 0,
+            state: StateSpec = '*',
+    ):
+        handlers = self._routes.setdefault(group, {})
+        is_new_handler = handler_type not in handlers
+        index = handlers.setdefault(handler_type, {})
+        route = Route(callback, filters)
+        states = frozenset(state if isinstance(state, list) else [state])
+
+        for key in keys:
+            index.setdefault(key, RouteSet()).add(route, None if '*' in states else states)
+
+        if is_new_handler and self._client is not None:
+            self._add_handler(self._client, handler_type, group)
+
+    def register(self, client: pyrogram.Client):
+        if self._client is client:
+            return
+
+        self._client = client
+
+        for group, handlers in self._routes.items():
+            for handler_type in handlers:
+                self._add_handler(client, handler_type, group)
+
+    def _add_handler(self, client: pyrogram.Client, handler_type: Type[Handler], group: int):
+        index = self._routes[group][handler_type]
+        _filter = pyrogram.filters.create(_match_route, f"{self.name}Filter", router=self, index=index)
+        client.add_handler(handler_type(self._dispatch, _filter), group)
+
+    async def get_user_state(self, update: pyrogram.types.Update) -> Optional[UserState]:
+        if not isinstance(update, (pyrogram.types.Message, pyrogram.types.CallbackQuery)):
+            return None
+
+        lazy_state: LazyUserState = getattr(update.bucket, 'state', None)
+
+        if lazy_state is None:
+            self.logger.warning("User state is None! You probably disabled user_state middleware!")
+            return None
+
+        return await lazy_state
+
+    async def match(self, index: RoutesIndex, client: pyrogram.Client, update: pyrogram.types.Update) -> bool:
+        for key in await self.get_route_keys(client, update):
+            route_set = index.get(key)
+
+            if route_set is None:
+                continue
+
+            routes = route_set.any_state
+
+            # State is loaded only for keys with stateful routes
+            if len(route_set.by_state) > 0:
+                state = await self.get_user_state(update)
+
+                if state is not None:
+                    routes = route_set.by_state.get(state.name, routes)
+
+            for route in routes:
+                if route.filters is None or await check_filter(route.filters, client, update):
+                    # Dispatcher calls the callback right after successful check, so it's safe to keep it on update
+                    update.bucket.route = route
+                    return True
+
+        return False
+
+    @staticmethod
+    async def _dispatch(client: pyrogram.Client, update: pyrogram.types.Update):
+        route: Route = update.bucket.route
+        await route.callback(client, update)
+
+
+# Routes messages by (prefix, command) and callback queries by action name of callback data
+class CommandRouter(Router):
+    def __init__(self, name: str = None):
+        super().__init__(name)
+        self.prefixes: list[str] = []
+        self._username: Optional[str] = None
+
+    async def get_route_keys(self, client: pyrogram.Client, update: pyrogram.types.Update) -> Iterable[RouteKey]:
+        if isinstance(update, pyrogram.types.CallbackQuery):
+            if not update.data:
+                return ()
+
+            return (CallbackData.get_action(update.data).lower(),)
+
+        if isinstance(update, pyrogram.types.Message):
+            return await self.get_command_keys(client, update)
+
+        return ()
+
+    async def get_command_keys(self, client: pyrogram.Client, message: pyrogram.types.Message) -> Iterable[RouteKey]:
+        text = message.text or message.caption
+
+        if not text:
+            return ()
+
+        # Longest prefixes go first, so "//" wins over "/"
+        for prefix in self.prefixes:
+            if not text.startswith(prefix):
+                continue
+
+            without_prefix = text[len(prefix):]
+            parts = without_prefix.split(maxsplit=1)
+
+            if len(parts) == 0 or not without_prefix.startswith(parts[0]):
+                continue
+
+            command, _, mention = parts[0].partition('@')
+
+            if bool(mention) and mention.lower() != (await self.get_username(client)).lower():
+                continue
+
+            command = command.lower()
+            message.command = [command] + [
+                escaped_quote_re.sub(r"\1", m.group(2) or m.group(3) or "")
+                for m in command_args_re.finditer(parts[1] if len(parts) > 1 else "")
+            ]
+
+            return ((prefix, command),)
+
+        return ()
+
+    async def get_username(self, client: pyrogram.Client) -> str:
+        if self._username is None:
+            self._username = (await client.get_me()).username or ""
+
+        return self._username
+
+    def add_command_route(
+            self,
+            callback: Callable,
+            command: str,
+            prefix: Union[str, list[str], None] = "/",
+            filters: pyrogram.filters.Filter = None,
+            group: int = 0,
+            state: StateSpec = '*',
+    ):
+        prefixes = prefix if isinstance(prefix, list) else [prefix]
+        prefixes = {p or "" for p in prefixes} or {""}
+
+        for p in prefixes:
+            if p not in self.prefixes:
+                self.prefixes.append(p)
+
+        self.prefixes.sort(key=len, reverse=True)
+        keys = [(p, command.lower()) for p in prefixes]
+        self.add_route(pyrogram.handlers.MessageHandler, callback, keys, filters, group, state)
+
+    def add_callback_route(
+            self,
+            callback: Callable,
+            action: str,
+            filters: pyrogram.filters.Filter = None,
+            group: int = 0,
+            state: StateSpec = '*',
+    ):
+        self.add_route(pyrogram.handlers.CallbackQueryHandler, callback, [action.lower()], filters, group, state)
+
+
+# Routes updates of users in a dialog by (dialog id, state name), so dialogs don't need any filters
+class DialogRouter(Router):
+    async def get_route_keys(self, client: pyrogram.Client, update: pyrogram.types.Update) -> Iterable[RouteKey]:
+        state = await self.get_user_state(update)
+
+        if state is None or not isinstance(state.data, dict) or '_dialog_id' not in state.data:
+            return ()
+
+        return ((state.data['_dialog_id'], state.name),)
+
+    def add_dialog(self, dialog_id: str, states: list[Optional[str]], callback: Callable, group: int = 50):
+        keys = [(dialog_id, state) for state in states]
+
+        for handler_type in (pyrogram.handlers.MessageHandler, pyrogram.handlers.CallbackQueryHandler):
+            self.add_route(handler_type, callback, keys, group=group)
+
+
+command_router = CommandRouter()
+dialog_router = DialogRouter()
@@ -0,0 +1,69 @@
+import re
+
+import pydantic
+
+from app.bot.middlewares.user_state import (
+    state_codec,
+    storage,
+)
+from app.bot.utils.state_storage import StorageItem
+
+STATE_KEY_PATTERN = '*_*'
+# State key and optional key of its fields written by LazyUserState.set_fields
+STATE_KEY_REGEX = re.compile(r'^(-?\d+_\d+)(:fields)?$')
+
+
+class StateStats(pydantic.BaseModel):
+    name: str
+    keys_count: int = 0
+    memory_usage: int = 0
+    without_ttl: int = 0
+
+
+async def collect_states_report(batch_size: int = 1000) -> list[StateStats]:
+    report: dict[str, StateStats] = {}
+    state_names: dict[str, str] = {}
+    # Fields keys could be scanned before their state keys, they are added to state stats in the end
+    fields_items: list[tuple[str, StorageItem]] = []
+
+    def add_item(name: str, item: StorageItem):
+        stats = report.setdefault(name, StateStats(name=name))
+        stats.keys_count += 1
+        stats.memory_usage += item.memory_usage
+
+        if item.ttl is None:
+            stats.without_ttl += 1
+
+    async for item in storage.iter_items(match=STATE_KEY_PATTERN, batch_size=batch_size):
+        match = STATE_KEY_REGEX.match(item.key)
+
+        if match is None:
+            continue
+
+        state_key, is_fields = match.groups()
+
+        if is_fields:
+            fields_items.append((state_key, item))
+        elif item.value is not None:
+            name = state_codec.decode(item.value).get('name') or '-'
+            state_names[state_key] = name
+            add_item(name, item)
+
+    for state_key, item in fields_items:
+        add_item(state_names.get(state_key, '-'), item)
+
+    return sorted(report.values(), key=lambda s: s.memory_usage, reverse=True)
+
+
+def format_states_report(report: list[StateStats], limit: int = None) -> str:
+    total = StateStats(
+        name='Total',
+        keys_count=sum(s.keys_count for s in report),
+        memory_usage=sum(s.memory_usage for s in report),
+        without_ttl=sum(s.without_ttl for s in report),
+    )
+
+    return "\n".join(
+        f"{s.name[:40]:<40} {s.keys_count:>10} keys {s.memory_usage / 1024:>12.1f} KiB {s.without_ttl:>10} no TTL"
+        for s in [*report[:limit], total]
+    )
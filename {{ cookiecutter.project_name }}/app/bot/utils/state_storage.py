@@ -0,0 +1,283 @@
+import abc
+import asyncio
+import fnmatch
+import logging
+import uuid
+from typing import (
+    AsyncIterator,
+    NamedTuple,
+    Optional,
+)
+
+import aioredis
+
+from app.utils.cache import (
+    InvalidationTracker,
+    LRUCache,
+)
+
+logger = logging.getLogger('StateStorage')
+
+
+class StorageItem(NamedTuple):
+    key: str
+    # None for keys with fields
+    value: Optional[bytes]
+    memory_usage: int
+    ttl: Optional[int]
+
+
+class StateStorage(abc.ABC):
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set_fields(self, key: str, fields: dict[str, bytes], ttl: int = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_fields(self, key: str) -> dict[str, bytes]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_items(self, match: str = '*', batch_size: int = 1000) -> AsyncIterator[StorageItem]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryStateStorage(StateStorage):
+    def __init__(self, maxsize: int = 100000):
+        self.cache = LRUCache(maxsize)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        self.cache.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.cache.pop(key)
+
+    async def set_fields(self, key: str, fields: dict[str, bytes], ttl: int = None):
+        # Stored dict is replaced instead of being changed in place, the same way as other values
+        self.cache.set(key, {**(self.cache.get(key) or {}), **fields}, ttl=ttl)
+
+    async def get_fields(self, key: str) -> dict[str, bytes]:
+        return dict(self.cache.get(key) or {})
+
+    async def iter_items(self, match: str = '*', batch_size: int = 1000) -> AsyncIterator[StorageItem]:
+        for key, value, ttl in self.cache.items():
+            if not fnmatch.fnmatchcase(key, match):
+                continue
+
+            ttl = int(ttl) if ttl is not None else None
+
+            if isinstance(value, bytes):
+                yield StorageItem(key, value, len(key) + len(value), ttl)
+            elif isinstance(value, dict):
+                memory_usage = len(key) + sum(len(k) + len(v) for k, v in value.items())
+                yield StorageItem(key, None, memory_usage, ttl)
+
+
+class RedisStateStorage(StateStorage):
+    def __init__(self, redis: aioredis.Redis):
+        self.redis = redis
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.redis.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        await self.redis.set(key, value, ex=ttl or None)
+
+    async def delete(self, *keys: str):
+        await self.redis.delete(*keys)
+
+    async def set_fields(self, key: str, fields: dict[str, bytes], ttl: int = None):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(key, mapping=fields)
+
+        if ttl:
+            pipe.expire(key, ttl)
+
+        await pipe.execute()
+
+    async def get_fields(self, key: str) -> dict[str, bytes]:
+        fields = await self.redis.hgetall(key)
+        return {k.decode('utf-8'): v for k, v in fields.items()}
+
+    async def iter_items(self, match: str = '*', batch_size: int = 1000) -> AsyncIterator[StorageItem]:
+        keys = []
+
+        async def fetch_batch() -> list[StorageItem]:
+            pipe = self.redis.pipeline(transaction=False)
+
+            for key in keys:
+                pipe.get(key).memory_usage(key).ttl(key)
+
+            # GET fails with WRONGTYPE for hashes, they are reported without value.
+            # Keys expired after SCAN have no memory usage and are skipped
+            results = await pipe.execute(raise_on_error=False)
+            items = [
+                StorageItem(
+                    key.decode('utf-8'),
+                    value if isinstance(value, bytes) else None,
+                    memory_usage,
+                    ttl if ttl >= 0 else None,
+                )
+                for key, (value, memory_usage, ttl) in zip(keys, zip(*[iter(results)] * 3))
+                if isinstance(memory_usage, int)
+            ]
+            keys.clear()
+            return items
+
+        async for key in self.redis.scan_iter(match=match, count=batch_size):
+            keys.append(key)
+
+            if len(keys) >= batch_size:
+                for item in await fetch_batch():
+                    yield item
+
+        if len(keys) > 0:
+            for item in await fetch_batch():
+                yield item
+
+    async def close(self):
+        await self.redis.close()
+
+
+class TieredStateStorage(StateStorage):
+    # Marks keys known to be absent in Redis, most users don't have any state
+    _absent = b''
+
+    def __init__(self, l1: MemoryStateStorage, l2: RedisStateStorage, *, channel: str, l1_ttl: int = 60):
+        self.l1 = l1
+        self.l2 = l2
+        self.channel = channel
+        # Bounds staleness if an invalidation message is lost
+        self.l1_ttl = l1_ttl
+        self.instance_id = uuid.uuid4().hex
+        self.tracker = InvalidationTracker()
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        self._ensure_listener()
+        value = self.l1.cache.get(key)
+
+        if value is None:
+            generations = self.tracker.begin([key])
+
+            try:
+                value = await self.l2.get(key)
+            finally:
+                fresh = self.tracker.end(generations)
+
+            # Value read before an invalidation would mask the newer one
+            if key in fresh:
+                self.l1.cache.set(key, value or self._absent, ttl=self.l1_ttl)
+
+        return value or None
+
+    async def set(self, key: str, value: bytes, ttl: int = None):
+        self._ensure_listener()
+        await self.l2.set(key, value, ttl=ttl)
+        self.tracker.invalidate(key)
+        self.l1.cache.set(key, value, ttl=min(ttl, self.l1_ttl) if ttl else self.l1_ttl)
+        await self._publish_invalidation(key)
+
+    async def delete(self, *keys: str):
+        self._ensure_listener()
+        await self.l2.delete(*keys)
+        self.tracker.invalidate(*keys)
+
+        for key in keys:
+            self.l1.cache.set(key, self._absent, ttl=self.l1_ttl)
+
+        await self._publish_invalidation(*keys)
+
+    async def set_fields(self, key: str, fields: dict[str, bytes], ttl: int = None):
+        # Fields are read rarely, so they aren't cached locally
+        await self.l2.set_fields(key, fields, ttl=ttl)
+
+    async def get_fields(self, key: str) -> dict[str, bytes]:
+        return await self.l2.get_fields(key)
+
+    def iter_items(self, match: str = '*', batch_size: int = 1000) -> AsyncIterator[StorageItem]:
+        return self.l2.iter_items(match=match, batch_size=batch_size)
+
+    async def _publish_invalidation(self, *keys: str):
+        for key in keys:
+            await self.l2.redis.publish(self.channel, f"{self.instance_id}:{key}")
+
+    def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def _listen_invalidations(self):
+        while True:
+            pubsub = self.l2.redis.pubsub()
+
+            try:
+                await pubsub.subscribe(self.channel)
+                # Invalidations could be missed while there was no subscription
+                self.tracker.invalidate_all()
+                self.l1.cache.clear()
+
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+
+                    instance_id, _, key = message['data'].decode('utf-8').partition(':')
+
+                    if instance_id != self.instance_id:
+                        self.tracker.invalidate(key)
+                        self.l1.cache.pop(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation listener failed. {e.__class__.__qualname__}. {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+
+        await self.l2.close()
+
+
+def create_state_storage(
+        name: str,
+        *,
+        redis_url: str,
+        memory_size: int,
+        l1_ttl: int,
+        channel: str,
+) -> StateStorage:
+    if name == 'memory':
+        return MemoryStateStorage(memory_size)
+
+    if name == 'redis':
+        return RedisStateStorage(aioredis.from_url(redis_url))
+
+    if name == 'tiered':
+        return TieredStateStorage(
+            MemoryStateStorage(memory_size),
+            RedisStateStorage(aioredis.from_url(redis_url)),
+            channel=channel,
+            l1_ttl=l1_ttl,
+        )
+
+    raise ValueError(f"Unknown state storage {name}. Available storages: memory, redis, tiered")
@@ -1 +1,2 @@
+from .crud_broadcast_job import crud_broadcast_job as broadcast_job
 from .crud_user import crud_user as user
@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import logging
+from typing import (
+    Any,
+    Generic,
+    Hashable,
+    Optional,
+    Type,
+    TypeVar,
+)
+
+import peewee
+
+from app.database.crud.model_cache import ModelCache
+from app.database.database import objects
+
+logger = logging.getLogger('BatchLoader')
+
+Model = TypeVar('Model', bound=peewee.Model)
+
+# (model, primary key) -> row loaded while handling the current update, see identity_map_middleware
+identity_map: contextvars.ContextVar[Optional[dict[tuple[Type[peewee.Model], Hashable], Any]]] = (
+    contextvars.ContextVar('identity_map', default=None)
+)
+
+
+# Collects loads of rows by primary key issued within one event loop tick and fetches them with a single query
+class BatchLoader(Generic[Model]):
+    def __init__(self, model: Type[Model], max_batch_size: int = 1000, *, cache: ModelCache[Model] = None):
+        self.model = model
+        self.cache = cache
+        self.primary_key: peewee.Field = model._meta.primary_key
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.loads = 0
+        self._pending: dict[Hashable, asyncio.Future] = {}
+        self._fetch_tasks: set[asyncio.Task] = set()
+
+    async def load(self, key: Any) -> Optional[Model]:
+        key = self.primary_key.adapt(key.get_id() if isinstance(key, peewee.Model) else key)
+
+        if objects.database.transaction_depth_async() > 0:
+            # Transaction connection belongs to the current task and batches are fetched in another one,
+            # uncommitted rows are not shared with other updates as well
+            return await objects.get_or_none(self.model, self.primary_key == key)
+
+        loaded = identity_map.get()
+
+        if loaded is not None and (self.model, key) in loaded:
+            return loaded[(self.model, key)]
+
+        future = self._pending.get(key)
+
+        if future is None:
+            self.loads += 1
+
+            if len(self._pending) == 0:
+                asyncio.get_running_loop().call_soon(self._dispatch)
+
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+
+            if len(self._pending) >= self.max_batch_size:
+                self._dispatch()
+
+        # Other callers wait for the same future, cancellation of one of them shouldn't affect others
+        row = self._copy(await asyncio.shield(future))
+
+        if loaded is not None:
+            loaded[(self.model, key)] = row
+
+        return row
+
+    def _copy(self, row: Optional[Model]) -> Optional[Model]:
+        # Callers of the same batch may handle different updates, each of them gets its own instance.
+        # Instances are shared only within one update through the identity map
+        if row is None:
+            return None
+
+        obj = self.model(__no_default__=True, **row.__data__)
+        obj._dirty.clear()
+        return obj
+
+    def forget(self, *keys: Any):
+        loaded = identity_map.get()
+
+        if loaded is None:
+            return
+
+        for key in keys:
+            key = self.primary_key.adapt(key.get_id() if isinstance(key, peewee.Model) else key)
+            loaded.pop((self.model, key), None)
+
+    def _dispatch(self):
+        if len(self._pending) == 0:
+            return
+
+        batch, self._pending = self._pending, {}
+        self.batches += 1
+        task = asyncio.create_task(self._fetch(batch))
+        self._fetch_tasks.add(task)
+        task.add_done_callback(self._fetch_tasks.discard)
+
+    async def _fetch(self, batch: dict[Hashable, asyncio.Future]):
+        # Rows invalidated while the batch is fetched are not written to cache, they could be read before the write
+        generations = self.cache.tracker.begin(batch) if self.cache is not None else {}
+        loaded = []
+
+        try:
+            rows = await self.cache.get_many(batch) if self.cache is not None else {}
+            missing = [key for key in batch if key not in rows]
+
+            if len(missing) > 0:
+                query = self.model.select().where(self.primary_key.in_(missing))
+                loaded = list(await objects.execute(query))
+                rows.update({row.get_id(): row for row in loaded})
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+
+            return
+        finally:
+            fresh = self.cache.tracker.end(generations) if self.cache is not None else set()
+
+        if self.cache is not None and len(loaded) > 0:
+            await self.cache.fill_many([row for row in loaded if self.cache.get_key(row) in fresh])
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(rows.get(key))
+
+    def stats(self) -> dict:
+        return {
+            'loads': self.loads,
+            'batches': self.batches,
+            'avg_batch_size': round(self.loads / self.batches, 2) if self.batches > 0 else 0.0,
+        }
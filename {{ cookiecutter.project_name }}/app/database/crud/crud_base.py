@@ -1,6 +1,11 @@
 import logging
-from functools import cached_property
+import operator
+from functools import (
+    cached_property,
+    reduce,
+)
 from typing import (
+    AsyncIterator,
     Generic,
     Optional,
     Type,
@@ -11,6 +16,8 @@ from typing import (
 import peewee
 import pydantic
 
+from app.database.crud.batch_loader import BatchLoader
+from app.database.crud.model_cache import ModelCache
 from app.database.database import objects
 from app.database.model.base_model import BaseModel
 from app.utils.encoders import jsonable_encoder
@@ -18,10 +25,24 @@ from app.utils.encoders import jsonable_encoder
 Model = TypeVar('Model', bound=BaseModel)
 PrimaryKey = Union[int, str, Model]
 
+BULK_CHUNK_SIZE = 1000
+# Serial types can't be used in casts
+CAST_TYPES = {'SERIAL': 'INTEGER', 'BIGSERIAL': 'BIGINT'}
+
+
+def chunked(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def to_dict(data_object: Union[dict, pydantic.BaseModel]) -> dict:
+    # Peewee fields convert values themselves, so there is no need to encode them
+    return data_object if isinstance(data_object, dict) else data_object.dict()
+
 
 class CRUDBase(Generic[Model]):
-    def __init__(self, model: Type[Model]):
+    def __init__(self, model: Type[Model], *, cache: ModelCache[Model] = None):
         self.model = model
+        self.cache = cache
         self.logger = logging.getLogger(self.__class__.__qualname__)
 
     @cached_property
@@ -32,9 +53,20 @@ class CRUDBase(Generic[Model]):
     def primary_key_name(self) -> Optional[str]:
         return self.primary_key.safe_name
 
+    @cached_property
+    def loader(self) -> BatchLoader[Model]:
+        return BatchLoader(self.model, cache=self.cache)
+
+    async def invalidate(self, *primary_keys: PrimaryKey):
+        # Rows loaded by the current update are dropped as well, so the next get returns the stored row
+        self.loader.forget(*primary_keys)
+
+        if self.cache is not None:
+            await self.cache.invalidate(*primary_keys)
+
     async def get(self, primary_key: PrimaryKey) -> Optional[Model]:
-        query = self.model.select().where(self.primary_key == primary_key)
-        return await objects.first(query)
+        # Lookups from the same event loop tick are fetched with one query
+        return await self.loader.load(primary_key)
 
     async def get_multi(
             self,
@@ -61,9 +93,53 @@ class CRUDBase(Generic[Model]):
 
         return await objects.execute(query)
 
+    def iterate(
+            self,
+            *,
+            select: list[peewee.Field] = None,
+            where: peewee.Expression = None,
+            batch_size: int = 1000,
+            tuples: bool = False,
+            reverse: bool = False,
+            offset_id: PrimaryKey = None,
+    ) -> AsyncIterator[Union[Model, tuple]]:
+        query = self.model.select(*(select or []))
+
+        if where is not None:
+            query = query.where(where)
+
+        return objects.iterate(
+            query,
+            self.primary_key,
+            batch_size=batch_size,
+            tuples=tuples,
+            desc=reverse,
+            after=offset_id,
+        )
+
     async def create(self, *, create_object: Union[dict, pydantic.BaseModel] = None, **kwargs) -> Model:
         create_data = {**jsonable_encoder(create_object or {}), **jsonable_encoder(kwargs)}
-        return await objects.create(self.model, **create_data)
+        obj = await objects.create(self.model, **create_data)
+        # Missing rows are not cached, only the identity map could keep None for a new row
+        self.loader.forget(obj)
+        return obj
+
+    def get_changed_fields(self, db_obj: Model, update_data: dict) -> dict[str, peewee.Field]:
+        changed = {}
+
+        for name, value in update_data.items():
+            field = self.model._meta.fields.get(name)
+
+            if field is None or field is self.primary_key:
+                continue
+
+            # Values are compared the way they would be stored, so "1" and 1 are the same for IntegerField
+            if name in db_obj.__data__ and field.adapt(value) == field.adapt(db_obj.__data__[name]):
+                continue
+
+            changed[name] = field
+
+        return changed
 
     async def update(
             self,
@@ -71,27 +147,255 @@ class CRUDBase(Generic[Model]):
             *,
             update_object: Union[dict, pydantic.BaseModel] = None,
             partial: bool = False,
-            only: bool = None,
+            only: list[Union[str, peewee.Field]] = None,
             **kwargs
     ) -> Model:
-        update_data = {**jsonable_encoder(update_object or {}, exclude_unset=partial), **jsonable_encoder(kwargs)}
-        obj_data_fields = jsonable_encoder(db_obj).get('__data__', [])
+        if isinstance(update_object, pydantic.BaseModel):
+            update_object = update_object.dict(exclude_unset=partial)
+
+        update_data = {**(update_object or {}), **kwargs}
+        changed = self.get_changed_fields(db_obj, update_data)
+
+        # Fields the caller already assigned on the object are saved too, the same way save() would do it
+        for field in db_obj.dirty_fields:
+            if field is not self.primary_key:
+                changed.setdefault(field.name, field)
+
+        if only is not None:
+            only_names = {f.name if isinstance(f, peewee.Field) else f for f in only}
+            changed = {name: field for name, field in changed.items() if name in only_names}
+
+        if len(changed) == 0:
+            return db_obj
 
-        for field in obj_data_fields:
-            if field in update_data:
-                try:
-                    setattr(db_obj, field, update_data[field])
-                except (AttributeError, ValueError, KeyError):
-                    pass
+        for name in changed:
+            try:
+                setattr(db_obj, name, update_data[name])
+            except (AttributeError, ValueError, KeyError):
+                pass
+
+        await objects.update(db_obj, only=list(changed.values()))
+        await self.invalidate(db_obj)
+
+        for name in changed:
+            db_obj._dirty.discard(name)
 
-        await objects.update(db_obj, only=only)
         return db_obj
 
+    def _build_upsert_query(self, rows: list[dict], *, skip_unchanged: bool = False) -> peewee.RawQuery:
+        update_fields = [
+            self.model._meta.fields[name]
+            for name in rows[0]
+            if name != self.primary_key_name and name in self.model._meta.fields
+        ]
+        query = self.model.insert_many(rows)
+
+        if len(update_fields) > 0:
+            where = None
+
+            if skip_unchanged:
+                where = reduce(operator.or_, [
+                    peewee.Expression(field, 'IS DISTINCT FROM', getattr(peewee.EXCLUDED, field.column_name))
+                    for field in update_fields
+                ])
+
+            query = query.on_conflict(conflict_target=[self.primary_key], preserve=update_fields, where=where)
+        else:
+            query = query.on_conflict_ignore()
+
+        upsert_sql, upsert_params = query.returning(*self.model._meta.sorted_fields).sql()
+
+        # Rows skipped by ON CONFLICT are not returned by RETURNING, so they are read back in the same statement
+        pk_column = self.primary_key.column_name
+        existing_sql, existing_params = self.model.select().where(
+            self.primary_key.in_([row[self.primary_key_name] for row in rows]),
+            peewee.SQL(f'"{pk_column}" NOT IN (SELECT "{pk_column}" FROM "upserted")'),
+        ).sql()
+
+        return self.model.raw(
+            f'WITH "upserted" AS ({upsert_sql}) SELECT * FROM "upserted" UNION ALL {existing_sql}',
+            *upsert_params,
+            *existing_params,
+        )
+
+    async def _select_skipped(self, rows: list[Model], primary_keys: list[PrimaryKey]) -> list[Model]:
+        # Read-back of the upsert statement uses its snapshot, so a row inserted by a concurrent transaction
+        # and skipped by ON CONFLICT is not returned. Such rows are selected again with a new snapshot
+        returned = {self.primary_key.adapt(row.get_id()) for row in rows}
+        missing = [pk for pk in primary_keys if self.primary_key.adapt(pk) not in returned]
+
+        if len(missing) == 0:
+            return list(rows)
+
+        query = self.model.select().where(self.primary_key.in_(missing))
+        return [*rows, *await objects.execute(query)]
+
+    def has_required_fields(self, data: dict) -> bool:
+        # Postgres checks NOT NULL constraints of the inserted row before ON CONFLICT resolves it to an update
+        return all(
+            data.get(field.name) is not None
+            for field in self.model._meta.sorted_fields
+            if not field.null and field.default is None
+        )
+
+    async def upsert(
+            self,
+            *,
+            data_object: Union[dict, pydantic.BaseModel] = None,
+            skip_unchanged: bool = False,
+            **kwargs
+    ) -> Model:
+        data = {**jsonable_encoder(data_object or {}), **jsonable_encoder(kwargs)}
+
+        if data.get(self.primary_key_name) is None:
+            raise ValueError(f"Primary key {self.primary_key_name} is required to upsert {self.model.__name__}")
+
+        obj_id = data[self.primary_key_name]
+        rows = await objects.execute(self._build_upsert_query([data], skip_unchanged=skip_unchanged))
+        rows = await self._select_skipped(rows, [obj_id])
+        await self.invalidate(obj_id)
+        return rows[0]
+
+    async def upsert_many(
+            self,
+            data_objects: list[Union[dict, pydantic.BaseModel]],
+            *,
+            skip_unchanged: bool = False,
+            chunk_size: int = BULK_CHUNK_SIZE,
+    ) -> list[Model]:
+        rows_by_columns: dict[tuple[str, ...], dict[PrimaryKey, dict]] = {}
+
+        for data_object in data_objects:
+            data = jsonable_encoder(data_object)
+            obj_id = data.get(self.primary_key_name)
+
+            if obj_id is None:
+                raise ValueError(f"Primary key {self.primary_key_name} is required to upsert {self.model.__name__}")
+
+            # The same row can't be affected twice by one INSERT ... ON CONFLICT, so the last version wins
+            rows_by_columns.setdefault(tuple(data.keys()), {})[obj_id] = data
+
+        results = []
+
+        for rows in rows_by_columns.values():
+            for chunk in chunked(list(rows.values()), chunk_size):
+                chunk_ids = [row[self.primary_key_name] for row in chunk]
+
+                async with objects.atomic():
+                    query = self._build_upsert_query(chunk, skip_unchanged=skip_unchanged)
+                    results.extend(await self._select_skipped(await objects.execute(query), chunk_ids))
+
+                await self.invalidate(*chunk_ids)
+
+        return results
+
+    async def create_many(
+            self,
+            data_objects: list[Union[dict, pydantic.BaseModel]],
+            *,
+            chunk_size: int = BULK_CHUNK_SIZE,
+    ) -> list[Model]:
+        results = []
+
+        for chunk in chunked([to_dict(data_object) for data_object in data_objects], chunk_size):
+            sql, params = self.model.insert_many(chunk).returning(*self.model._meta.sorted_fields).sql()
+
+            async with objects.atomic():
+                # Insert query returns only the first id in peewee_async, raw query returns all rows
+                rows = list(await objects.execute(self.model.raw(sql, *params)))
+
+            self.loader.forget(*rows)
+            results.extend(rows)
+
+        return results
+
+    def _get_cast_type(self, field: peewee.Field) -> str:
+        ctx = self.model._meta.database.get_sql_context()
+        column_type = ctx.sql(field.ddl_datatype(ctx)).query()[0]
+        return CAST_TYPES.get(column_type, column_type)
+
+    @staticmethod
+    def _get_db_value(field: peewee.Field, value):
+        value = field.db_value(value)
+        # Lists are expanded to records by peewee, arrays should be passed as a single parameter
+        return peewee.Value(value, unpack=False) if isinstance(value, (list, tuple)) else value
+
+    def _build_update_many_query(self, rows: list[dict]) -> peewee.Update:
+        fields = [self.model._meta.fields[name] for name in rows[0]]
+        columns = [field.column_name for field in fields]
+        values = peewee.ValuesList(
+            [[self._get_db_value(field, row[field.name]) for field in fields] for row in rows],
+            columns=columns,
+            alias='data',
+        )
+        # Values are sent as untyped literals, so they are casted to types of columns
+        casted = {
+            field: peewee.Cast(getattr(values.c, field.column_name), self._get_cast_type(field))
+            for field in fields
+        }
+
+        return self.model.update({
+            field: value for field, value in casted.items() if field is not self.primary_key
+        }).from_(values).where(self.primary_key == casted[self.primary_key])
+
+    async def update_many(
+            self,
+            data_objects: list[Union[dict, pydantic.BaseModel]],
+            *,
+            chunk_size: int = BULK_CHUNK_SIZE,
+    ) -> int:
+        # Rows are matched by primary key, only passed fields are updated
+        rows_by_columns: dict[tuple[str, ...], dict[PrimaryKey, dict]] = {}
+
+        for data_object in data_objects:
+            data = {k: v for k, v in to_dict(data_object).items() if k in self.model._meta.fields}
+            obj_id = data.get(self.primary_key_name)
+
+            if obj_id is None:
+                raise ValueError(f"Primary key {self.primary_key_name} is required to update {self.model.__name__}")
+
+            if len(data) > 1:
+                rows_by_columns.setdefault(tuple(sorted(data.keys())), {})[obj_id] = data
+
+        updated = 0
+
+        for rows in rows_by_columns.values():
+            for chunk in chunked(list(rows.values()), chunk_size):
+                async with objects.atomic():
+                    updated += await objects.execute(self._build_update_many_query(chunk))
+
+                await self.invalidate(*[row[self.primary_key_name] for row in chunk])
+
+        return updated
+
+    async def delete_many(self, primary_keys: list[PrimaryKey], *, chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        ids = list({pk.get_id() if isinstance(pk, peewee.Model) else pk for pk in primary_keys})
+        deleted = 0
+
+        # Whole chunk is a single array parameter, its items are converted by primary key field
+        def to_array(values: list) -> list:
+            return [self.primary_key.db_value(value) for value in values]
+
+        for chunk in chunked(ids, chunk_size):
+            array = peewee.Value(chunk, unpack=False, converter=to_array)
+            query = self.model.delete().where(self.primary_key == peewee.fn.ANY(array))
+
+            async with objects.atomic():
+                deleted += await objects.execute(query)
+
+            await self.invalidate(*chunk)
+
+        return deleted
+
     async def create_or_update(self, *, data_object: Union[dict, pydantic.BaseModel] = None, **kwargs) -> Model:
         data = {**jsonable_encoder(data_object or {}), **jsonable_encoder(kwargs)}
         obj_id = data.get(self.primary_key_name)
 
         if bool(obj_id):
+            if self.has_required_fields(data):
+                return await self.upsert(data_object=data)
+
+            # Partial data can't be inserted, so only an existing row is updated
             obj = await self.get(obj_id)
 
             if bool(obj):
@@ -101,6 +405,7 @@ class CRUDBase(Generic[Model]):
 
     async def delete(self, obj: Model, *, recursive: bool = False, delete_nullable: bool = False) -> Model:
         await objects.delete(obj, recursive=recursive, delete_nullable=delete_nullable)
+        await self.invalidate(obj)
         return obj
 
     async def get_total_count(self) -> int:
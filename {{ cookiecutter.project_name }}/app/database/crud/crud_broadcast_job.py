@@ -0,0 +1,57 @@
+import datetime
+from typing import Optional
+
+import peewee
+
+from app.database.crud.crud_base import CRUDBase
+from app.database.database import objects
+from app.database.model.broadcast_job import (
+    BroadcastJob,
+    BroadcastJobStatus,
+)
+
+
+class CRUDBroadcastJob(CRUDBase[BroadcastJob]):
+    async def get_last(self) -> Optional[BroadcastJob]:
+        return await objects.first(self.model.select().order_by(self.model.id.desc()))
+
+    async def get_running(self) -> list[BroadcastJob]:
+        query = self.model.select().where(self.model.status == BroadcastJobStatus.RUNNING).order_by(self.model.id)
+        return list(await objects.execute(query))
+
+    async def set_status(self, job: BroadcastJob, status: str) -> BroadcastJob:
+        now = datetime.datetime.utcnow()
+        finished_at = now if status == BroadcastJobStatus.FINISHED else job.finished_at
+        return await self.update(job, status=status, updated_at=now, finished_at=finished_at)
+
+    async def save_progress(
+            self,
+            job: BroadcastJob,
+            *,
+            last_user_id: int,
+            sent: int = 0,
+            blocked: int = 0,
+            failed_users: list[int] = None,
+    ):
+        # Counters are incremented in place, so the checkpoint and results are committed together
+        failed_users = failed_users or []
+        query = self.model.update(
+            last_user_id=last_user_id,
+            sent=self.model.sent + sent,
+            blocked=self.model.blocked + blocked,
+            failed_users=peewee.fn.array_cat(
+                self.model.failed_users,
+                peewee.Cast(peewee.Value(failed_users, unpack=False), 'bigint[]'),
+            ),
+            updated_at=datetime.datetime.utcnow(),
+        ).where(self.model.id == job.id).returning(self.model)
+        rows = await objects.execute(query)
+        await self.invalidate(job)
+
+        if len(rows) > 0:
+            job.__data__.update(rows[0].__data__)
+
+        return job
+
+
+crud_broadcast_job = CRUDBroadcastJob(BroadcastJob)
@@ -1,19 +1,103 @@
+import asyncio
+from functools import partial
+from typing import (
+    Hashable,
+    Optional,
+    Type,
+)
+
 import pyrogram.types
 
 from app.database.crud.crud_base import CRUDBase
+from app.database.crud.model_cache import create_model_cache
+from app.database.crud.write_behind import WriteBehindQueue
 from app.database.model.user import User
+from app.settings import settings
+from app.utils.cache import LRUCache
+
+UserFingerprint = tuple[str, str, str, str]
+
+
+def get_user_fingerprint(user: pyrogram.types.User) -> UserFingerprint:
+    return user.first_name, user.last_name, user.username, user.language_code
+
+
+def get_user_profile(user: pyrogram.types.User) -> dict:
+    return dict(
+        id=user.id,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        username=user.username,
+        language_code=user.language_code
+    )
 
 
 class CRUDUser(CRUDBase[User]):
-    async def create_or_update_from_pyrogram_user(self, user: pyrogram.types.User) -> User:
-        return await self.create_or_update(
-            id=user.id,
-            first_name=user.first_name,
-            last_name=user.last_name,
-            username=user.username,
-            language_code=user.language_code
+    def __init__(self, model: Type[User]):
+        super().__init__(
+            model,
+            cache=create_model_cache(model, maxsize=settings.USER_MODEL_CACHE_SIZE, ttl=settings.USER_MODEL_CACHE_TTL),
+        )
+        self.profile_cache = LRUCache(settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+        # Profile cache keeps whole rows encoded by the model cache and is invalidated together with it
+        self.cache.on_invalidate(self._on_users_invalidated)
+        self.write_behind = WriteBehindQueue(
+            self,
+            flush_interval=settings.USER_WRITE_BEHIND_INTERVAL_MS / 1000,
+            max_batch_size=settings.USER_WRITE_BEHIND_MAX_BATCH,
         )
 
+    async def create_or_update_from_pyrogram_user(self, user: pyrogram.types.User) -> User:
+        db_user = await self.upsert(skip_unchanged=True, **get_user_profile(user))
+        self.cache_profile(user.id, get_user_fingerprint(user), db_user)
+        return db_user
+
+    async def get_or_sync_from_pyrogram_user(self, user: pyrogram.types.User) -> User:
+        fingerprint = get_user_fingerprint(user)
+        cached = self.profile_cache.get(user.id, count=False)
+
+        if cached is not None and cached[0] == fingerprint:
+            self.profile_cache.hits += 1
+            return self.cache.decode(cached[1])
+
+        self.profile_cache.misses += 1
+        profile = get_user_profile(user)
+        # Profile cache entry could be expired or evicted, stored row is read from the model cache then
+        db_user = self.cache.decode(cached[1]) if cached is not None else await self.get(user.id)
+
+        if db_user is None:
+            # Unknown user, wait for the batch to get actual row with is_admin and other stored fields
+            db_user = await self.write_behind.put(profile)
+        elif get_user_fingerprint(db_user) != fingerprint:
+            # Known user changed profile, the row is written in background
+            db_user = self.model(**{**db_user.__data__, **profile})
+            db_user._dirty.clear()
+            self.write_behind.put(profile).add_done_callback(partial(self._on_profile_written, user.id))
+
+        self.cache_profile(user.id, fingerprint, db_user)
+        return db_user
+
+    def cache_profile(self, user_id: int, fingerprint: UserFingerprint, db_user: Optional[User]):
+        # Rows are stored encoded, so every update gets its own instance and changes of one
+        # handler, saved or not, don't leak into others
+        if db_user is not None:
+            self.profile_cache.set(user_id, (fingerprint, self.cache.encode(db_user)))
+
+    def _on_profile_written(self, user_id: int, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            self.invalidate_cached_user(user_id)
+
+    def _on_users_invalidated(self, user_ids: Optional[list[Hashable]]):
+        if user_ids is None:
+            self.profile_cache.clear()
+            return
+
+        for user_id in user_ids:
+            self.invalidate_cached_user(user_id)
+
+    def invalidate_cached_user(self, user_id: int):
+        self.profile_cache.pop(user_id)
+
     async def set_user_admin(self, user: User) -> User:
         self.logger.warning(f"User {user.id} @{user.username} promoted to be an admin")
         return await self.update(user, is_admin=True)
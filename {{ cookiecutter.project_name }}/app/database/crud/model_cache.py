@@ -0,0 +1,319 @@
+import asyncio
+import datetime
+import decimal
+import logging
+import uuid
+import zlib
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Hashable,
+    Iterable,
+    Optional,
+    Type,
+    TypeVar,
+)
+
+import aioredis
+import peewee
+
+from app.settings import settings
+from app.utils import codecs
+from app.utils.cache import (
+    InvalidationTracker,
+    LRUCache,
+)
+
+logger = logging.getLogger('ModelCache')
+
+Model = TypeVar('Model', bound=peewee.Model)
+# Called with invalidated primary keys or with None when every row could be changed
+InvalidationListener = Callable[[Optional[list[Hashable]]], None]
+
+# Values of these types are stored as strings and parsed back by peewee fields
+STRING_TYPES = (datetime.datetime, datetime.date, datetime.time, decimal.Decimal, uuid.UUID)
+# Marks recently invalidated rows in both cache levels
+TOMBSTONE = b''
+
+
+# Read-through cache of model rows by primary key. Rows are stored as a compact list of column values
+# in a local LRU and optionally in Redis, changes are announced to other instances via pub/sub
+class ModelCache(Generic[Model]):
+    instances: list['ModelCache'] = []
+
+    def __init__(
+            self,
+            model: Type[Model],
+            *,
+            maxsize: int = 10000,
+            ttl: float = 60,
+            redis: aioredis.Redis = None,
+            redis_ttl: int = 3600,
+            tombstone_ttl: int = 5,
+            prefix: str = 'model_cache',
+            codec: str = 'json',
+    ):
+        self.model = model
+        self.primary_key: peewee.Field = model._meta.primary_key
+        self.fields: list[peewee.Field] = list(model._meta.sorted_fields)
+        self.l1 = LRUCache(maxsize, ttl=ttl)
+        self.redis = redis
+        self.redis_ttl = redis_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.codec = codecs.get_codec(codec)
+        self.key_prefix = f"{prefix}:{model._meta.table_name}"
+        self.channel = f"{self.key_prefix}:invalidations"
+        # Rows stored by another version of the model are ignored
+        self.layout = zlib.crc32(','.join(f.column_name for f in self.fields).encode('utf-8'))
+        self.instance_id = uuid.uuid4().hex
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.tracker = InvalidationTracker()
+        self.invalidation_listeners: list[InvalidationListener] = []
+        self._listener: Optional[asyncio.Task] = None
+        ModelCache.instances.append(self)
+
+    def get_key(self, primary_key: Any) -> Hashable:
+        return self.primary_key.adapt(primary_key.get_id() if isinstance(primary_key, peewee.Model) else primary_key)
+
+    def encode(self, obj: Model) -> bytes:
+        values = [self.layout]
+
+        for field in self.fields:
+            value = obj.__data__.get(field.name)
+            values.append(str(value) if isinstance(value, STRING_TYPES) else value)
+
+        return self.codec.encode(values)
+
+    def decode(self, data: bytes) -> Optional[Model]:
+        values = codecs.decode(data)
+
+        if not values or values[0] != self.layout:
+            return None
+
+        obj = self.model(**{
+            field.name: field.python_value(value) if value is not None else None
+            for field, value in zip(self.fields, values[1:])
+        })
+        obj._dirty.clear()
+        return obj
+
+    async def get(self, primary_key: Any) -> Optional[Model]:
+        return (await self.get_many([primary_key])).get(self.get_key(primary_key))
+
+    async def get_many(self, primary_keys: Iterable[Any]) -> dict[Hashable, Model]:
+        self._ensure_listener()
+        found = {}
+        missing = []
+
+        for key in {self.get_key(pk) for pk in primary_keys}:
+            data = self.l1.get(key, count=False)
+            obj = self.decode(data) if data else None
+
+            if obj is not None:
+                self.l1.hits += 1
+                found[key] = obj
+            else:
+                self.l1.misses += 1
+                missing.append(key)
+
+        if self.redis is None or len(missing) == 0:
+            return found
+
+        generations = self.tracker.begin(missing)
+
+        try:
+            values = await self.redis.mget([f"{self.key_prefix}:{key}" for key in missing])
+        except Exception as e:
+            logger.warning(f"Unable to read {self.key_prefix} from Redis. {e.__class__.__qualname__}. {e}")
+            return found
+        finally:
+            fresh = self.tracker.end(generations)
+
+        for key, data in zip(missing, values):
+            if data == TOMBSTONE and key in fresh:
+                # Row was invalidated by another instance recently, local fills should wait as well
+                self.l1.set(key, TOMBSTONE, ttl=self.tombstone_ttl)
+
+            obj = self.decode(data) if data else None
+
+            if obj is None:
+                self.l2_misses += 1
+                continue
+
+            self.l2_hits += 1
+            found[key] = obj
+
+            if key in fresh:
+                self.l1.set(key, data)
+
+        return found
+
+    async def set(self, obj: Model):
+        await self.set_many([obj])
+
+    async def set_many(self, objs: Iterable[Model]):
+        self._ensure_listener()
+        encoded = {self.get_key(obj): self.encode(obj) for obj in objs}
+
+        for key, data in encoded.items():
+            self.l1.set(key, data)
+
+        if self.redis is None or len(encoded) == 0:
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+
+            for key, data in encoded.items():
+                pipe.set(f"{self.key_prefix}:{key}", data, ex=self.redis_ttl)
+
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Unable to write {self.key_prefix} to Redis. {e.__class__.__qualname__}. {e}")
+
+    async def fill_many(self, objs: Iterable[Model]):
+        # Unlike set_many, rows read from the database don't replace cached rows and recent invalidations.
+        # Rows read before an invalidation should be filtered out by caller with tracker
+        self._ensure_listener()
+        encoded = {
+            key: self.encode(obj)
+            for key, obj in ((self.get_key(obj), obj) for obj in objs)
+            if self.l1.get(key, count=False) != TOMBSTONE
+        }
+
+        for key, data in encoded.items():
+            self.l1.set(key, data)
+
+        if self.redis is None or len(encoded) == 0:
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+
+            for key, data in encoded.items():
+                pipe.set(f"{self.key_prefix}:{key}", data, ex=self.redis_ttl, nx=True)
+
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Unable to write {self.key_prefix} to Redis. {e.__class__.__qualname__}. {e}")
+
+    def on_invalidate(self, listener: InvalidationListener):
+        # Lets caches built on top of model rows follow local and remote invalidations
+        self.invalidation_listeners.append(listener)
+
+    def _notify_invalidation(self, keys: Optional[list[Hashable]]):
+        for listener in self.invalidation_listeners:
+            try:
+                listener(keys)
+            except Exception as e:
+                logger.warning(f"Invalidation listener of {self.key_prefix} failed. {e.__class__.__qualname__}. {e}")
+
+    async def invalidate(self, *primary_keys: Any):
+        keys = {self.get_key(pk) for pk in primary_keys}
+        self.tracker.invalidate(*keys)
+        self._notify_invalidation(list(keys))
+
+        for key in keys:
+            self.l1.set(key, TOMBSTONE, ttl=self.tombstone_ttl)
+
+        if self.redis is None or len(keys) == 0:
+            return
+
+        self._ensure_listener()
+
+        try:
+            # Tombstones instead of deletion, so fills of other instances don't put the old rows back
+            pipe = self.redis.pipeline(transaction=False)
+
+            for key in keys:
+                pipe.set(f"{self.key_prefix}:{key}", TOMBSTONE, ex=self.tombstone_ttl)
+
+            pipe.publish(self.channel, self.codec.encode([self.instance_id, list(keys)]))
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Unable to invalidate {self.key_prefix} in Redis. {e.__class__.__qualname__}. {e}")
+
+    def _ensure_listener(self):
+        if self.redis is not None and (self._listener is None or self._listener.done()):
+            self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def _listen_invalidations(self):
+        while True:
+            pubsub = self.redis.pubsub()
+
+            try:
+                await pubsub.subscribe(self.channel)
+                # Invalidations could be missed while there was no subscription
+                self.tracker.invalidate_all()
+                self.l1.clear()
+                self._notify_invalidation(None)
+
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+
+                    instance_id, keys = codecs.decode(message['data'])
+
+                    if instance_id != self.instance_id:
+                        keys = [self.get_key(key) for key in keys]
+                        self.tracker.invalidate(*keys)
+                        self._notify_invalidation(keys)
+
+                        for key in keys:
+                            self.l1.set(key, TOMBSTONE, ttl=self.tombstone_ttl)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Invalidation listener failed. {e.__class__.__qualname__}. {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def stats(self) -> dict:
+        items = self.l1.items()
+        l2_total = self.l2_hits + self.l2_misses
+
+        return {
+            'model': self.model.__name__,
+            **self.l1.stats(),
+            'memory_usage': sum(len(data) for _, data, _ in items),
+            'l2_hits': self.l2_hits,
+            'l2_misses': self.l2_misses,
+            'l2_hit_ratio': round(self.l2_hits / l2_total, 4) if l2_total > 0 else 0.0,
+        }
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+
+        if self.redis is not None:
+            await self.redis.close()
+
+
+def create_model_cache(model: Type[Model], *, maxsize: int, ttl: float) -> ModelCache[Model]:
+    redis = None
+
+    if settings.MODEL_CACHE_REDIS:
+        redis = aioredis.from_url(f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}")
+
+    return ModelCache(
+        model,
+        maxsize=maxsize,
+        ttl=ttl,
+        redis=redis,
+        redis_ttl=settings.MODEL_CACHE_REDIS_TTL,
+        tombstone_ttl=settings.MODEL_CACHE_TOMBSTONE_TTL,
+        prefix=f"{settings.BOT_ID}_model_cache",
+        codec=settings.MODEL_CACHE_CODEC,
+    )
+
+
+def collect_model_cache_stats() -> list[dict]:
+    return [cache.stats() for cache in ModelCache.instances]
+
+
+async def close_model_caches():
+    for cache in ModelCache.instances:
+        await cache.close()
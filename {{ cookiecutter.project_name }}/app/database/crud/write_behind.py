@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import (
+    Generic,
+    Optional,
+)
+
+from app.database.crud.crud_base import (
+    CRUDBase,
+    Model,
+    PrimaryKey,
+)
+
+
+class WriteBehindQueue(Generic[Model]):
+    def __init__(
+            self,
+            crud: CRUDBase[Model],
+            *,
+            flush_interval: float = 0.2,
+            max_batch_size: int = 500,
+            skip_unchanged: bool = True,
+    ):
+        self.crud = crud
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.skip_unchanged = skip_unchanged
+        self.logger = logging.getLogger(f"{self.__class__.__qualname__}[{crud.model.__name__}]")
+
+        self.flushes_count = 0
+        self.flushed_rows_count = 0
+        self.last_flush_size = 0
+        self.last_flush_latency = 0.0
+
+        self._pending: dict[PrimaryKey, dict] = {}
+        self._waiters: dict[PrimaryKey, list[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: set[asyncio.Task] = set()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, data: dict) -> asyncio.Future:
+        # Future resolves to the stored model after the flush, it is fine to not await it
+        loop = asyncio.get_running_loop()
+        obj_id = data[self.crud.primary_key_name]
+
+        self._pending[obj_id] = {**self._pending.get(obj_id, {}), **data}
+        future = loop.create_future()
+        self._waiters.setdefault(obj_id, []).append(future)
+
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+        return future
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+
+            if len(self._pending) == 0:
+                return
+
+            pending, waiters = self._pending, self._waiters
+            self._pending, self._waiters = {}, {}
+            started_at = time.monotonic()
+
+            try:
+                rows = await self.crud.upsert_many(list(pending.values()), skip_unchanged=self.skip_unchanged)
+            except Exception as e:
+                self.logger.error(f"Unable to flush {len(pending)} rows. {e.__class__.__qualname__}. {e}")
+
+                for futures in waiters.values():
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+
+                return
+
+            self.flushes_count += 1
+            self.flushed_rows_count += len(pending)
+            self.last_flush_size = len(pending)
+            self.last_flush_latency = time.monotonic() - started_at
+            self.logger.debug(f"Flushed {self.last_flush_size} rows in {self.last_flush_latency * 1000:.1f} ms")
+
+            rows_by_id = {getattr(row, self.crud.primary_key_name): row for row in rows}
+
+            for obj_id, futures in waiters.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(rows_by_id.get(obj_id))
+
+    async def close(self):
+        if len(self._flush_tasks) > 0:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'flushes': self.flushes_count,
+            'flushed_rows': self.flushed_rows_count,
+            'last_flush_size': self.last_flush_size,
+            'last_flush_latency_ms': round(self.last_flush_latency * 1000, 2),
+        }
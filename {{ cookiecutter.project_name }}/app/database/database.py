@@ -1,24 +1,176 @@
+import asyncio
+import logging
+import re
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+)
+
 import peewee
 from peewee_async import (
+    AsyncPostgresqlConnection,
     Manager,
     PooledPostgresqlDatabase,
 )
+from psycopg2.errors import QueryCanceled
 
 from app.settings import settings
 
-database = PooledPostgresqlDatabase(
+logger = logging.getLogger('Database')
+
+# Lists of parameters and rows are collapsed, so "IN (%s, %s)" and "IN (%s, %s, %s)" are the same query
+_params_list_re = re.compile(r'%s(?:, %s)+')
+_rows_list_re = re.compile(r'(\([^()]*\))(?:, \([^()]*\))+')
+
+MAX_QUERY_FINGERPRINTS = 500
+
+
+def get_query_fingerprint(sql: str) -> str:
+    return _rows_list_re.sub(r'\1, ...', _params_list_re.sub('%s, ...', sql))
+
+
+class QueryStats:
+    __slots__ = ('count', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def observe(self, elapsed: float):
+        self.count += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+
+class DatabaseMetrics:
+    def __init__(self, slow_query_threshold: float = None):
+        self.slow_query_threshold = slow_query_threshold
+        self.acquires = 0
+        self.acquire_timeouts = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+        self.slow_queries = 0
+        self.queries: dict[str, QueryStats] = {}
+
+    def observe_acquire(self, elapsed: float):
+        self.acquires += 1
+        self.acquire_wait_total += elapsed
+        self.acquire_wait_max = max(self.acquire_wait_max, elapsed)
+
+    def observe_query(self, sql: str, elapsed: float):
+        fingerprint = get_query_fingerprint(sql)
+        stats = self.queries.get(fingerprint)
+
+        if stats is None:
+            # Unbounded number of distinct queries shouldn't eat memory
+            if len(self.queries) >= MAX_QUERY_FINGERPRINTS:
+                fingerprint = 'other'
+
+            stats = self.queries.setdefault(fingerprint, QueryStats())
+
+        stats.observe(elapsed)
+
+        if self.slow_query_threshold and elapsed >= self.slow_query_threshold:
+            self.slow_queries += 1
+            logger.warning(f"Slow query {elapsed * 1000:.1f} ms: {fingerprint}")
+
+    def top_queries(self, limit: int = 10, key: str = 'total_time') -> list[tuple[str, QueryStats]]:
+        return sorted(self.queries.items(), key=lambda item: getattr(item[1], key), reverse=True)[:limit]
+
+    def reset(self):
+        self.__init__(self.slow_query_threshold)
+
+
+class InstrumentedPostgresqlConnection(AsyncPostgresqlConnection):
+    def __init__(self, *, metrics: DatabaseMetrics, acquire_timeout: float = None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.acquire_timeout = acquire_timeout
+
+    async def acquire(self):
+        start = time.perf_counter()
+
+        try:
+            return await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.acquire_timeouts += 1
+            logger.warning(
+                f"Unable to acquire connection in {self.acquire_timeout} s, "
+                f"{self.pool.size - self.pool.freesize} of {self.pool.maxsize} connections are in use"
+            )
+            raise
+        finally:
+            self.metrics.observe_acquire(time.perf_counter() - start)
+
+    async def cursor(self, conn=None, *args, **kwargs):
+        cursor = await super().cursor(conn, *args, **kwargs)
+        execute = cursor.execute
+
+        async def timed_execute(operation, *execute_args, **execute_kwargs):
+            start = time.perf_counter()
+
+            try:
+                return await execute(operation, *execute_args, **execute_kwargs)
+            except asyncio.CancelledError as e:
+                # aiopg turns every canceled statement into CancelledError, statement timeout should be a query error
+                if isinstance(e.__context__, QueryCanceled) and 'statement timeout' in str(e.__context__):
+                    raise e.__context__
+                raise
+            finally:
+                self.metrics.observe_query(operation, time.perf_counter() - start)
+
+        cursor.execute = timed_execute
+        return cursor
+
+
+class InstrumentedPooledPostgresqlDatabase(PooledPostgresqlDatabase):
+    def init(self, database, **kwargs):
+        self.acquire_timeout = kwargs.pop('acquire_timeout', None)
+        self.pool_recycle = kwargs.pop('pool_recycle', -1)
+        self.metrics = DatabaseMetrics(kwargs.pop('slow_query_threshold', None))
+        super().init(database, **kwargs)
+        self.init_async(conn_cls=self._create_async_connection)
+
+    def _create_async_connection(self, **kwargs) -> InstrumentedPostgresqlConnection:
+        return InstrumentedPostgresqlConnection(metrics=self.metrics, acquire_timeout=self.acquire_timeout, **kwargs)
+
+    @property
+    def connect_params_async(self):
+        return {**super().connect_params_async, 'pool_recycle': self.pool_recycle}
+
+
+def get_connect_options() -> dict:
+    if not settings.POSTGRES_STATEMENT_TIMEOUT_MS:
+        return {}
+
+    return {'options': f"-c statement_timeout={settings.POSTGRES_STATEMENT_TIMEOUT_MS}"}
+
+
+database = InstrumentedPooledPostgresqlDatabase(
     settings.POSTGRES_DB,
     host=settings.POSTGRES_HOST,
     port=settings.POSTGRES_PORT,
     user=settings.POSTGRES_USER,
     password=settings.POSTGRES_PASSWORD,
-    autoconnect=True
+    autoconnect=True,
+    min_connections=settings.POSTGRES_POOL_MIN_SIZE,
+    max_connections=settings.POSTGRES_POOL_MAX_SIZE,
+    acquire_timeout=settings.POSTGRES_POOL_ACQUIRE_TIMEOUT or None,
+    pool_recycle=settings.POSTGRES_POOL_RECYCLE,
+    slow_query_threshold=settings.POSTGRES_SLOW_QUERY_MS / 1000 if settings.POSTGRES_SLOW_QUERY_MS else None,
+    **get_connect_options(),
 )
 
 
 class CustomManager(Manager):
     async def peek(self, query, n: int = 1):
         await self.connect()
+
+        if isinstance(query, peewee.SelectBase) and (query._limit is None or query._limit > n):
+            query = query.limit(n)
+
         rows = (await self.execute(query))[:n]
 
         if rows:
@@ -42,6 +194,78 @@ class CustomManager(Manager):
         except peewee.DoesNotExist:
             return None
 
+    async def iterate(
+            self,
+            query: peewee.Select,
+            key: peewee.Field,
+            *,
+            batch_size: int = 1000,
+            tuples: bool = False,
+            desc: bool = False,
+            after: Any = None,
+    ) -> AsyncIterator[Any]:
+        # Streams rows with keyset batches by unique key, so only one batch is kept in memory.
+        # Query should not have its own order and limit
+        key_index = None
+
+        if tuples:
+            selected = list(query._returning)
+            key_index = next((i for i, f in enumerate(selected) if f is key), None)
+
+            if key_index is None:
+                query = query.select_extend(key)
+
+            query = query.tuples()
+
+        query = query.order_by(key.desc() if desc else key).limit(batch_size)
+
+        while True:
+            batch_query = query
+
+            if after is not None:
+                batch_query = query.where(key < after if desc else key > after)
+
+            rows = await self.execute(batch_query)
+
+            for row in rows:
+                if not tuples:
+                    yield row
+                elif key_index is None:
+                    yield row[:-1]
+                else:
+                    yield row
+
+            if len(rows) < batch_size:
+                return
+
+            last_row = rows[-1]
+            after = last_row[-1 if key_index is None else key_index] if tuples else last_row.__data__[key.name]
+
+    @property
+    def metrics(self) -> DatabaseMetrics:
+        return self.database.metrics
+
+    def pool_stats(self) -> dict:
+        pool = getattr(self.database._async_conn, 'pool', None)
+        metrics = self.metrics
+        query_count = sum(stats.count for stats in metrics.queries.values())
+        query_time = sum(stats.total_time for stats in metrics.queries.values())
+        acquire_wait_avg = metrics.acquire_wait_total / metrics.acquires if metrics.acquires > 0 else 0.0
+
+        return {
+            'min_size': self.database.min_connections,
+            'max_size': self.database.max_connections,
+            'in_use': pool.size - pool.freesize if pool is not None else 0,
+            'idle': pool.freesize if pool is not None else 0,
+            'acquires': metrics.acquires,
+            'acquire_timeouts': metrics.acquire_timeouts,
+            'acquire_wait_avg_ms': round(acquire_wait_avg * 1000, 3),
+            'acquire_wait_max_ms': round(metrics.acquire_wait_max * 1000, 3),
+            'queries': query_count,
+            'query_time_avg_ms': round(query_time / query_count * 1000, 3) if query_count > 0 else 0.0,
+            'slow_queries': metrics.slow_queries,
+        }
+
     async def update(self, obj, only=None):
         await super(CustomManager, self).update(obj, only=only)
         return obj
@@ -0,0 +1,47 @@
+"""Peewee migrations -- 002_broadcast_job.py."""
+
+import datetime as dt
+
+import peewee as pw
+
+try:
+    import playhouse.postgres_ext as pw_pext
+except ImportError:
+    pass
+
+SQL = pw.SQL
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    """Write your migrations here."""
+
+    @migrator.create_model
+    class BroadcastJob(pw.Model):
+        id = pw.AutoField()
+        created_by = pw.BigIntegerField()
+        from_chat_id = pw.BigIntegerField()
+        message_id = pw.IntegerField()
+        users = pw_pext.ArrayField(field_class=pw.BigIntegerField, index=False, null=True)
+        status = pw.CharField(constraints=[SQL("DEFAULT 'running'")], default='running', index=True, max_length=16)
+        last_user_id = pw.BigIntegerField(constraints=[SQL("DEFAULT 0")], default=0)
+        total = pw.IntegerField(null=True)
+        sent = pw.IntegerField(constraints=[SQL("DEFAULT 0")], default=0)
+        blocked = pw.IntegerField(constraints=[SQL("DEFAULT 0")], default=0)
+        failed_users = pw_pext.ArrayField(
+            field_class=pw.BigIntegerField,
+            constraints=[SQL("DEFAULT '{}'")],
+            default=list,
+            index=False,
+        )
+        created_at = pw.DateTimeField(default=dt.datetime.utcnow)
+        updated_at = pw.DateTimeField(default=dt.datetime.utcnow)
+        finished_at = pw.DateTimeField(null=True)
+
+        class Meta:
+            table_name = "broadcast_job"
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    """Write your rollback migrations here."""
+
+    migrator.remove_model('broadcast_job')
@@ -0,0 +1,37 @@
+import datetime
+
+import peewee
+from playhouse.postgres_ext import ArrayField
+
+from .base_model import BaseModel
+
+
+class BroadcastJobStatus:
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    FINISHED = 'finished'
+
+
+class BroadcastJob(BaseModel):
+    id = peewee.AutoField()
+    created_by = peewee.BigIntegerField()
+    # Source message which is copied to every user
+    from_chat_id = peewee.BigIntegerField()
+    message_id = peewee.IntegerField()
+    # Explicit list of recipients, all users if null
+    users = ArrayField(peewee.BigIntegerField, index=False, null=True)
+    status = peewee.CharField(max_length=16, default=BroadcastJobStatus.RUNNING, index=True)
+    # Every user with id up to this one has been processed
+    last_user_id = peewee.BigIntegerField(default=0)
+    total = peewee.IntegerField(null=True)
+    sent = peewee.IntegerField(default=0)
+    blocked = peewee.IntegerField(default=0)
+    # Successful deliveries are not stored, only ids of users which didn't get the message
+    failed_users = ArrayField(peewee.BigIntegerField, index=False, default=list)
+    created_at = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    updated_at = peewee.DateTimeField(default=datetime.datetime.utcnow)
+    finished_at = peewee.DateTimeField(null=True)
+
+    @property
+    def failed(self) -> int:
+        return len(self.failed_users)
@@ -4,9 +4,18 @@ import pyrogram
 import uvloop
 
 from app.bot.dialogs.test_dialog import test_dialog
+from app.bot.middlewares.identity_map import identity_map_middleware
 from app.bot.middlewares.log import log_middleware
 from app.bot.middlewares.user import user_middleware
+from app.bot.middlewares import user_state
 from app.bot.middlewares.user_state import user_state_middleware
+from app.bot.utils.broadcast_jobs import broadcast_jobs
+from app.bot.utils.router import (
+    command_router,
+    dialog_router,
+)
+from app.database import crud
+from app.database.crud.model_cache import close_model_caches
 from app.utils.logger import configure_logger
 
 
@@ -20,13 +29,23 @@ async def main():
 
     bot = Bot()
     bot.add_middleware(log_middleware)
+    bot.add_middleware(identity_map_middleware)
     bot.add_middleware(user_middleware)
     bot.add_middleware(user_state_middleware)
 
+    command_router.register(bot)
+    dialog_router.register(bot)
+
     test_dialog.register(bot)
 
     async with bot:
+        await broadcast_jobs.resume_interrupted(bot)
         await pyrogram.idle()
+        await broadcast_jobs.close()
+
+    await crud.user.write_behind.close()
+    await user_state.storage.close()
+    await close_model_caches()
 
 
 if __name__ == '__main__':
@@ -17,11 +17,64 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = 'postgres'
     POSTGRES_USER: str = 'postgres'
     POSTGRES_PASSWORD: str
+    POSTGRES_POOL_MIN_SIZE: int = 1
+    POSTGRES_POOL_MAX_SIZE: int = 20
+    # Seconds to wait for a free connection, 0 waits forever
+    POSTGRES_POOL_ACQUIRE_TIMEOUT: float = 10
+    # Seconds after which connections are reopened, -1 keeps them forever
+    POSTGRES_POOL_RECYCLE: float = 3600
+    # 0 disables the limit
+    POSTGRES_STATEMENT_TIMEOUT_MS: int = 0
+    # Queries running longer are logged, 0 disables logging
+    POSTGRES_SLOW_QUERY_MS: int = 500
 
     # Redis
     REDIS_HOST: str = "redis"
     REDIS_PORT: int = 6379
 
+    # User states
+    # Storage of user states: memory (single instance only), redis or tiered (local LRU in front of redis)
+    USER_STATE_STORAGE: str = 'redis'
+    USER_STATE_MEMORY_SIZE: int = 100000
+    USER_STATE_L1_TTL: int = 60
+    # Codec used to store user states: json, orjson or msgpack. Stored values are readable with any of them
+    USER_STATE_CODEC: str = 'json'
+    # Seconds of inactivity before user state expires, None keeps states forever
+    USER_STATE_TTL: int = None
+    DIALOG_STATE_TTL: int = 60 * 60 * 24
+    # Store dialog answers as separate fields and write only the new answer on each step
+    DIALOG_DELTA_STATE: bool = False
+
+    # Users cache
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 300
+    USER_WRITE_BEHIND_INTERVAL_MS: int = 200
+    USER_WRITE_BEHIND_MAX_BATCH: int = 500
+
+    # Model cache
+    # Redis is used as a shared cache level and to invalidate local caches of other instances.
+    # Without it local caches of other instances may be stale up to their TTL
+    MODEL_CACHE_REDIS: bool = False
+    MODEL_CACHE_REDIS_TTL: int = 3600
+    # Rows read from the database are not cached for this time after invalidation,
+    # so a read which started before a write can't put the old row back
+    MODEL_CACHE_TOMBSTONE_TTL: int = 5
+    MODEL_CACHE_CODEC: str = 'json'
+    USER_MODEL_CACHE_SIZE: int = 10000
+    USER_MODEL_CACHE_TTL: int = 60
+
+    # Pagination
+    PAGINATION_COUNT_CACHE_SIZE: int = 1000
+    PAGINATION_COUNT_CACHE_TTL: int = 60
+
+    # Broadcast
+    # Messages per second, Telegram allows about 30 messages per second for bots
+    BROADCAST_RATE: float = 25
+    BROADCAST_WORKERS: int = 30
+    BROADCAST_PROGRESS_INTERVAL: float = 10
+    # Broadcast job progress is committed after this number of processed users or on every progress report
+    BROADCAST_CHECKPOINT_BATCH: int = 100
+
     # Files settings
     DATA_DIR: Path = ".data"
 
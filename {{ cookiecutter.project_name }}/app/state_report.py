@@ -0,0 +1,17 @@
+import asyncio
+
+from app.bot.utils.state_report import (
+    collect_states_report,
+    format_states_report,
+)
+from app.utils.logger import configure_logger
+
+
+async def main():
+    report = await collect_states_report()
+    print(format_states_report(report))
+
+
+if __name__ == '__main__':
+    configure_logger()
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Hashable,
+    Iterable,
+    Optional,
+)
+
+_missing = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, *, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[Any, Optional[float]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _missing, count=False) is not _missing
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def get(self, key: Hashable, default: Any = None, *, count: bool = True) -> Any:
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            if count:
+                self.misses += 1
+
+            return default
+
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+
+            if count:
+                self.misses += 1
+
+            return default
+
+        self._data.move_to_end(key)
+
+        if count:
+            self.hits += 1
+
+        return value
+
+    def set(self, key: Hashable, value: Any, *, ttl: float = None):
+        ttl = ttl if ttl is not None else self.ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value, _ = self._data.pop(key)
+            return value
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self) -> list[tuple[Hashable, Any, Optional[float]]]:
+        # (key, value, seconds left to live) for every alive entry, without touching LRU order
+        now = time.monotonic()
+
+        return [
+            (key, value, expires_at - now if expires_at is not None else None)
+            for key, (value, expires_at) in list(self._data.items())
+            if expires_at is None or expires_at > now
+        ]
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hit_ratio, 4),
+        }
+
+
+# Counts invalidations of keys while they are being read, so a value read before an invalidation
+# isn't cached after it
+class InvalidationTracker:
+    def __init__(self):
+        # key -> [reads in flight, invalidations since the first of them]
+        self._reads: dict[Hashable, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._reads)
+
+    def begin(self, keys: Iterable[Hashable]) -> dict[Hashable, int]:
+        generations = {}
+
+        for key in keys:
+            entry = self._reads.setdefault(key, [0, 0])
+            entry[0] += 1
+            generations[key] = entry[1]
+
+        return generations
+
+    def end(self, generations: dict[Hashable, int]) -> set[Hashable]:
+        # Every begin should be followed by end, returns keys which weren't invalidated in between
+        fresh = set()
+
+        for key, generation in generations.items():
+            entry = self._reads[key]
+            entry[0] -= 1
+
+            if entry[1] == generation:
+                fresh.add(key)
+
+            if entry[0] == 0:
+                del self._reads[key]
+
+        return fresh
+
+    def invalidate(self, *keys: Hashable):
+        for key in keys:
+            entry = self._reads.get(key)
+
+            if entry is not None:
+                entry[1] += 1
+
+    def invalidate_all(self):
+        for entry in self._reads.values():
+            entry[1] += 1
@@ -0,0 +1,87 @@
+import abc
+from typing import Any
+
+from app.utils import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec(abc.ABC):
+    name: str
+
+    @abc.abstractmethod
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        return decode(data)
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def encode(self, obj: Any) -> bytes:
+        data = json.dumps(obj)
+        return data if isinstance(data, bytes) else data.encode('utf-8')
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("orjson codec requires orjson package to be installed")
+
+    def encode(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError("msgpack codec requires msgpack package to be installed")
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+
+CODECS: dict[str, type[Codec]] = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgpackCodec.name: MsgpackCodec,
+}
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown codec {name}. Available codecs: {', '.join(CODECS.keys())}")
+
+
+def is_msgpack(data: bytes) -> bool:
+    # msgpack maps and arrays start with 0x80-0x9f or 0xdc-0xdf, while JSON documents start with ASCII
+    first_byte = data[0]
+    return 0x80 <= first_byte <= 0x9f or 0xdc <= first_byte <= 0xdf
+
+
+def decode(data: bytes) -> Any:
+    # Values are decoded by their format rather than by configured codec,
+    # so switching the codec doesn't break already stored values
+    if is_msgpack(data):
+        if msgpack is None:
+            raise RuntimeError("Unable to decode msgpack value, msgpack package is not installed")
+
+        return msgpack.unpackb(data, raw=False)
+
+    return json.loads(data)
@@ -0,0 +1,88 @@
+# Compare fixed chunks with sleep (old Bot.broadcast_message) and Broadcaster against a fake Telegram
+# which raises FloodWait above its rate limit. Limit is scaled up to keep the run short.
+# Usage: PYTHONPATH=. python -m benchmarks.broadcast
+import asyncio
+import collections
+import time
+import tracemalloc
+
+from pyrogram.errors import (
+    FloodWait,
+    UserIsBlocked,
+)
+
+from app.bot.utils.broadcast import Broadcaster
+from benchmarks.utils import header
+
+USERS_COUNT = 5000
+RATE_LIMIT = 500
+LATENCY = 0.05
+BLOCKED_EVERY = 50
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.sent_at = collections.deque()
+        self.delivered = 0
+        self.flood_waits = 0
+
+    async def send(self, chat_id: int):
+        await asyncio.sleep(LATENCY)
+        now = time.monotonic()
+
+        while self.sent_at and self.sent_at[0] <= now - 1:
+            self.sent_at.popleft()
+
+        if len(self.sent_at) >= RATE_LIMIT:
+            self.flood_waits += 1
+            raise FloodWait(1)
+
+        self.sent_at.append(now)
+
+        if chat_id % BLOCKED_EVERY == 0:
+            raise UserIsBlocked()
+
+        self.delivered += 1
+
+
+async def chunks_with_sleep(telegram: FakeTelegram, chats: list[int]):
+    tasks = [telegram.send(chat_id) for chat_id in chats]
+
+    for i in range(0, len(tasks), RATE_LIMIT):
+        await asyncio.gather(*tasks[i:i + RATE_LIMIT], return_exceptions=True)
+        await asyncio.sleep(1)
+
+
+async def broadcaster(telegram: FakeTelegram, chats: list[int]):
+    async def iterate():
+        for chat_id in chats:
+            yield chat_id
+
+    await Broadcaster(telegram.send, rate=RATE_LIMIT * 0.9, workers=RATE_LIMIT // 10).run(iterate(), total=len(chats))
+
+
+def bench(name: str, func):
+    telegram = FakeTelegram()
+    chats = list(range(1, USERS_COUNT + 1))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    asyncio.run(func(telegram, chats))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{name:<24} {elapsed:>6.2f} s  delivered {telegram.delivered:>5}/{USERS_COUNT - USERS_COUNT // BLOCKED_EVERY}"
+        f"  flood waits {telegram.flood_waits:>5}  peak memory {peak / 1024:>8.1f} KiB"
+    )
+
+
+def main():
+    header(f"{USERS_COUNT} users, limit {RATE_LIMIT} msg/s, latency {LATENCY * 1000:.0f} ms")
+    bench("chunks with sleep", chunks_with_sleep)
+    bench("broadcaster", broadcaster)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Compare callback data pack/unpack cost and size: urlencoded legacy format vs compact schemas.
+# Usage: PYTHONPATH=. python -m benchmarks.callback_data
+from types import SimpleNamespace
+
+import pyrogram
+
+from app.bot.utils.callback_data import (
+    CallbackData,
+    CallbackSchema,
+)
+from benchmarks.utils import (
+    header,
+    measure,
+)
+
+DATA = {'page': 12, 'item': 1234567, 'category': 'books', 'desc': True}
+FIELDS = {'page': int, 'item': int, 'category': str, 'desc': bool}
+
+text_schema = CallbackSchema('lst', FIELDS)
+binary_schema = CallbackSchema('lsb', FIELDS, binary=True)
+
+
+def make_callback_query(data: str) -> pyrogram.types.CallbackQuery:
+    callback_query = pyrogram.types.CallbackQuery.__new__(pyrogram.types.CallbackQuery)
+    callback_query.data = data
+    callback_query.bucket = SimpleNamespace()
+    return callback_query
+
+
+def main():
+    packed = {
+        'legacy urlencode': CallbackData.pack('list_items', DATA),
+        'compact text': text_schema.pack(DATA),
+        'compact binary': binary_schema.pack(DATA),
+    }
+
+    header("Packed size")
+
+    for name, data in packed.items():
+        print(f"{name:<48} {len(data.encode('utf-8')):>7} bytes  {data}")
+
+    header("Pack")
+    measure("legacy urlencode", lambda: CallbackData.pack('list_items', DATA))
+    measure("compact text", lambda: text_schema.pack(DATA))
+    measure("compact binary", lambda: binary_schema.pack(DATA))
+
+    header("Unpack")
+
+    for name, data in packed.items():
+        measure(name, lambda: CallbackData.parse(data))
+
+    header("Unpack 5 times per update (filters + handler)")
+
+    for name, data in packed.items():
+        def unpack_many():
+            callback_query = make_callback_query(data)
+
+            for _ in range(5):
+                CallbackData.unpack(callback_query)
+
+        measure(f"{name}, cached on update", unpack_many)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Compare handler lookup cost for commands and callback actions: sequential pyrogram filters vs CommandRouter.
+# Usage: PYTHONPATH=. python -m benchmarks.command_dispatch
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault('BOT_API_ID', '0')
+os.environ.setdefault('BOT_API_HASH', 'benchmark')
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('POSTGRES_PASSWORD', 'benchmark')
+os.environ.setdefault('USER_STATE_STORAGE', 'memory')
+
+import pyrogram  # noqa: E402
+
+from app.bot.utils.callback_actions import CallbackAction  # noqa: E402
+from app.bot.utils.chat_commands import ChatCommand  # noqa: E402
+from app.bot.utils.router import (  # noqa: E402
+    CommandRouter,
+    check_filter,
+)
+from benchmarks.utils import (  # noqa: E402
+    header,
+    measure_async,
+)
+
+HANDLERS_COUNTS = (10, 50, 200, 1000)
+
+
+class FakeClient:
+    executor = None
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    async def get_me(self):
+        return SimpleNamespace(username='benchmark_bot')
+
+
+async def noop(_, __):
+    pass
+
+
+def make_message(text: str) -> pyrogram.types.Message:
+    message = pyrogram.types.Message.__new__(pyrogram.types.Message)
+    message.text = text
+    message.caption = None
+    message.bucket = SimpleNamespace()
+    return message
+
+
+def make_callback_query(data: str) -> pyrogram.types.CallbackQuery:
+    callback_query = pyrogram.types.CallbackQuery.__new__(pyrogram.types.CallbackQuery)
+    callback_query.data = data
+    callback_query.bucket = SimpleNamespace()
+    return callback_query
+
+
+async def linear_dispatch(client: FakeClient, filters: list[pyrogram.filters.Filter], update: pyrogram.types.Update):
+    # What pyrogram dispatcher does with plain handlers: check filters one by one until first match
+    for flt in filters:
+        if await check_filter(flt, client, update):
+            return
+
+
+def bench_commands(handlers_count: int):
+    client = FakeClient()
+    commands = [ChatCommand(f"command{i}", private=False) for i in range(handlers_count)]
+    message = make_message(f"/command{handlers_count - 1} first second")
+    # pyrogram command filter keeps bot username in module global
+    pyrogram.filters.username = 'benchmark_bot'
+    filters = [command.filter for command in commands]
+
+    router = CommandRouter()
+
+    for command in commands:
+        router.add_command_route(noop, command.command, command.prefix)
+
+    index = router._routes[0][pyrogram.handlers.MessageHandler]
+
+    async def linear():
+        await linear_dispatch(client, filters, message)
+
+    async def indexed():
+        await router.match(index, client, message)
+
+    number = max(100_000 // handlers_count, 100)
+    measure_async(f"linear command filters, {handlers_count} handlers", linear, number=number)
+    measure_async(f"command router, {handlers_count} handlers", indexed, number=number)
+
+
+def bench_callback_actions(handlers_count: int):
+    client = FakeClient()
+    actions = [CallbackAction(f"action{i}") for i in range(handlers_count)]
+    callback_query = make_callback_query(actions[-1].pack({'page': 2, 'item': 15}))
+    filters = [action.filter for action in actions]
+
+    router = CommandRouter()
+
+    for action in actions:
+        router.add_callback_route(noop, action)
+
+    index = router._routes[0][pyrogram.handlers.CallbackQueryHandler]
+
+    async def linear():
+        await linear_dispatch(client, filters, callback_query)
+
+    async def indexed():
+        await router.match(index, client, callback_query)
+
+    number = max(100_000 // handlers_count, 100)
+    measure_async(f"linear callback filters, {handlers_count} handlers", linear, number=number)
+    measure_async(f"callback router, {handlers_count} handlers", indexed, number=number)
+
+
+def main():
+    for handlers_count in HANDLERS_COUNTS:
+        header(f"Last registered handler matches, {handlers_count} handlers")
+        bench_commands(handlers_count)
+        bench_callback_actions(handlers_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Compare DialogAction.parse_result cost: compiled validators vs pydantic model per answer.
+# Usage: PYTHONPATH=. python -m benchmarks.dialog_validation
+import os
+
+os.environ.setdefault('BOT_API_ID', '0')
+os.environ.setdefault('BOT_API_HASH', 'benchmark')
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('POSTGRES_PASSWORD', 'benchmark')
+os.environ.setdefault('USER_STATE_STORAGE', 'memory')
+
+import pyrogram  # noqa: E402
+
+from app.bot.utils.dialog import DialogActionText  # noqa: E402
+from benchmarks.utils import (  # noqa: E402
+    header,
+    measure,
+    measure_async,
+)
+
+ACTIONS = {
+    'str': (dict(), 'Alexander'),
+    'str, min_length + regex': (dict(min_length=3, regex=r'^[A-Za-z]+$'), 'Alexander'),
+    'int, ge + le': (dict(result_type=int, ge=18, le=99), '31'),
+    'float, gt': (dict(result_type=float, gt=0), '12.5'),
+    'bool': (dict(result_type=bool), 'yes'),
+}
+
+
+def make_message(text: str) -> pyrogram.types.Message:
+    message = pyrogram.types.Message.__new__(pyrogram.types.Message)
+    message.text = text
+    message.caption = None
+    return message
+
+
+def main():
+    header("Action creation")
+    measure("compiled validator", lambda: DialogActionText("Question", result_type=int, ge=18), number=10_000)
+    measure(
+        "pydantic model",
+        lambda: DialogActionText("Question", result_type=int, ge=18).create_result_model(),
+        number=10_000,
+    )
+
+    for name, (kwargs, answer) in ACTIONS.items():
+        header(f"parse_result, {name}")
+        action = DialogActionText("Question", **kwargs)
+        message = make_message(answer)
+
+        # Same action validated by pydantic model, as before compiled validators
+        pydantic_action = DialogActionText("Question", **kwargs)
+        pydantic_action.validator = None
+        pydantic_action.result_model = pydantic_action.create_result_model()
+
+        measure_async("compiled validator", lambda: action.parse_result(message), number=50_000)
+        measure_async("pydantic model", lambda: pydantic_action.parse_result(message), number=50_000)
+
+
+if __name__ == '__main__':
+    main()
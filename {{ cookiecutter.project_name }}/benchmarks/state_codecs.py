@@ -0,0 +1,79 @@
+# Compare user state encoding cost and size.
+# Usage: PYTHONPATH=. python -m benchmarks.state_codecs
+import pydantic
+
+from app.utils import (
+    codecs,
+    json,
+)
+from benchmarks.utils import (
+    header,
+    measure,
+)
+
+
+class LegacyUserState(pydantic.BaseModel):
+    chat_id: int
+    user_id: int
+    name: str = None
+    data: dict = None
+
+    class Config:
+        json_dumps = json.dumps
+        json_loads = json.loads
+        validate_assignment = True
+
+
+STATE = {
+    'name': 'CheckoutDialog_1a2b3c4d:delivery_address',
+    'data': {
+        '_dialog_id': 'CheckoutDialog_1a2b3c4d',
+        'first_name': 'Alexander',
+        'age': 31,
+        'favorite_color': 'Green',
+        'items': [{'id': i, 'quantity': i % 3 + 1, 'gift': i % 2 == 0} for i in range(5)],
+    },
+}
+
+
+def legacy_encode() -> bytes:
+    state = LegacyUserState(chat_id=123456789, user_id=123456789)
+    state.name = STATE['name']
+    state.data = STATE['data']
+    value = state.json()
+    return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+def main():
+    legacy_value = legacy_encode()
+
+    header("Encode")
+    measure("legacy (pydantic .json())", legacy_encode, number=20_000)
+
+    available_codecs = []
+
+    for name in codecs.CODECS:
+        try:
+            available_codecs.append(codecs.get_codec(name))
+        except RuntimeError as e:
+            print(f"{name:<48} skipped: {e}")
+
+    for codec in available_codecs:
+        measure(codec.name, lambda: codec.encode(STATE), number=20_000)
+
+    header("Decode")
+    measure("legacy (json.loads(value.decode()))", lambda: json.loads(legacy_value.decode('utf-8')), number=20_000)
+
+    for codec in available_codecs:
+        value = codec.encode(STATE)
+        measure(codec.name, lambda: codec.decode(value), number=20_000)
+
+    header("Size")
+    print(f"{'legacy':<48} {len(legacy_value):>10} bytes")
+
+    for codec in available_codecs:
+        print(f"{codec.name:<48} {len(codec.encode(STATE)):>10} bytes")
+
+
+if __name__ == '__main__':
+    main()
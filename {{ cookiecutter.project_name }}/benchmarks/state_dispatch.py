@@ -0,0 +1,85 @@
+# Compare handler lookup cost by user state: sequential CustomFilters.state checks vs state index of CommandRouter.
+# Handlers of the same callback action are registered for different states, like steps of stateful flows.
+# Usage: PYTHONPATH=. python -m benchmarks.state_dispatch
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault('BOT_API_ID', '0')
+os.environ.setdefault('BOT_API_HASH', 'benchmark')
+os.environ.setdefault('BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('POSTGRES_PASSWORD', 'benchmark')
+os.environ.setdefault('USER_STATE_STORAGE', 'memory')
+
+import pyrogram  # noqa: E402
+
+from app.bot.middlewares.user_state import (  # noqa: E402
+    LazyUserState,
+    UserState,
+)
+from app.bot.utils.custom_filters import CustomFilters  # noqa: E402
+from app.bot.utils.router import (  # noqa: E402
+    CommandRouter,
+    check_filter,
+)
+from benchmarks.utils import (  # noqa: E402
+    header,
+    measure_async,
+)
+
+HANDLERS_COUNTS = (10, 50, 200, 1000)
+ACTION = 'step'
+
+
+async def noop(_, __):
+    pass
+
+
+def make_callback_query(state_name: str) -> pyrogram.types.CallbackQuery:
+    lazy_state = LazyUserState(chat_id=1, user_id=1)
+    lazy_state._state = UserState(chat_id=1, user_id=1, name=state_name)
+
+    callback_query = pyrogram.types.CallbackQuery.__new__(pyrogram.types.CallbackQuery)
+    callback_query.data = ACTION
+    callback_query.bucket = SimpleNamespace(state=lazy_state)
+    return callback_query
+
+
+def bench(handlers_count: int, state_name: str):
+    states = [f"Flow_{i}:step" for i in range(handlers_count)]
+    callback_query = make_callback_query(state_name)
+
+    # What pyrogram dispatcher does with plain handlers: check filters one by one until first match
+    state_filters = [CustomFilters.state(state) for state in states]
+
+    async def linear():
+        for flt in state_filters:
+            if await check_filter(flt, None, callback_query):
+                return
+
+    router = CommandRouter()
+
+    for state in states:
+        router.add_callback_route(noop, ACTION, state=state)
+
+    index = router._routes[0][pyrogram.handlers.CallbackQueryHandler]
+
+    async def indexed():
+        await router.match(index, None, callback_query)
+
+    # Keep total number of checked filters per run roughly the same
+    number = max(100_000 // handlers_count, 100)
+    measure_async(f"linear state filters, {handlers_count} handlers", linear, number=number)
+    measure_async(f"command router, {handlers_count} handlers", indexed, number=number)
+
+
+def main():
+    for handlers_count in HANDLERS_COUNTS:
+        header(f"Last registered state matches, {handlers_count} handlers")
+        bench(handlers_count, f"Flow_{handlers_count - 1}:step")
+
+    header("No state matches (most updates)")
+    bench(HANDLERS_COUNTS[-1], None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import asyncio
+import time
+import timeit
+from typing import Callable
+
+
+def measure(name: str, func: Callable, *, number: int = 100_000, repeat: int = 5) -> float:
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{name:<48} {best * 1_000_000:>10.3f} us")
+    return best
+
+
+def header(title: str):
+    print()
+    print(title)
+    print("-" * 61)
+
+
+def measure_async(name: str, coro_func: Callable, *, number: int = 10_000, repeat: int = 5) -> float:
+    async def run() -> float:
+        start = time.perf_counter()
+
+        for _ in range(number):
+            await coro_func()
+
+        return time.perf_counter() - start
+
+    loop = asyncio.new_event_loop()
+
+    try:
+        best = min(loop.run_until_complete(run()) for _ in range(repeat)) / number
+    finally:
+        loop.close()
+
+    print(f"{name:<48} {best * 1_000_000:>10.3f} us")
+    return best
@@ -0,0 +1,60 @@
+import datetime
+from urllib.parse import (
+    parse_qsl,
+    urlparse,
+)
+
+import peewee
+
+from app.bot.utils.callback_data import (
+    CallbackSchema,
+    check_size,
+)
+from app.bot.utils.pagination import (
+    CURSOR_BEFORE,
+    Pagination,
+)
+
+
+class Post(peewee.Model):
+    title = peewee.CharField()
+    created_at = peewee.DateTimeField()
+
+
+LATEST_KEY = (datetime.datetime(2022, 12, 31, 23, 59, 59, 999999), 2 ** 31 - 1)
+
+
+def make_pagination(**kwargs) -> Pagination:
+    return Pagination('/posts', Post.select(), keyset=True, keyset_field=Post.created_at, **kwargs)
+
+
+def test_datetime_cursor_fits_callback_data():
+    pagination = make_pagination()
+    cursor = pagination.get_cursor(CURSOR_BEFORE, LATEST_KEY)
+    data = check_size(pagination.get_page_callback_data(99999, cursor))
+
+    parsed = make_pagination(cursor=dict(parse_qsl(urlparse(data).query))['c'])
+    assert (parsed.cursor_kind, parsed.cursor_value) == (CURSOR_BEFORE, LATEST_KEY)
+
+
+def test_datetime_cursor_fits_callback_schema():
+    schema = CallbackSchema('test_posts', {'p': int, 'c': str})
+    pagination = make_pagination(callback_schema=schema)
+    data = pagination.get_page_callback_data(99999, pagination.get_cursor(CURSOR_BEFORE, LATEST_KEY))
+
+    parsed = make_pagination(callback_schema=schema, cursor=schema.unpack(data)['c'])
+    assert (parsed.cursor_kind, parsed.cursor_value) == (CURSOR_BEFORE, LATEST_KEY)
+
+
+def test_cursor_values_with_separator():
+    pagination = Pagination('/posts', Post.select(), keyset=True, keyset_field=Post.title)
+    key = ('a~b%7E%', 1)
+
+    parsed = Pagination(
+        '/posts',
+        Post.select(),
+        keyset=True,
+        keyset_field=Post.title,
+        cursor=pagination.get_cursor(CURSOR_BEFORE, key),
+    )
+    assert parsed.cursor_value == key